@@ -1,56 +1,140 @@
 import threading
-from picamera import PiCamera
-from picamera.array import PiRGBArray
+import logging
 import numpy as np
 import cv2
 import time
+from Camera.frame_source import PiCameraSource
 
 """
 Camera module
 
-provides basic interface with the raspberry pi camera that fits the better the requirements of the project
+provides basic interface with the raspberry pi camera that fits the better the requirements of the project.
+frames are captured from a FrameSource, the pi camera by default or a recording to replay.
 """
 
+# number of frames between logs of the achieved frame rate
+FPS_LOG_INTERVAL = 100
+
+
 class Camera:
-    def __init__(self, camera_resolution=(2592, 1936), frame_rate=20, zoom=(0.0, 0.0, 1.0, 1.0)):
-        # initialize camera configurations
-        self.cam = PiCamera()
-        self.cam.zoom = zoom
-        self.cam.resolution = camera_resolution
-        # variable that holds the current grayscale image
-        self._image = np.empty((self.cam.resolution[1], self.cam.resolution[0]), dtype=np.uint8)
-        # variables that holds the current BGR image
-        self._bgr_image = np.empty((self.cam.resolution[1]*self.cam.resolution[0]*3, ), dtype=np.uint8)
-        # a lock to prevent writing to the image variable and reading at the same time
+    def __init__(self, camera_resolution=(2592, 1936), frame_rate=20, zoom=(0.0, 0.0, 1.0, 1.0), buffer_size=3,
+                 source=None):
+        # source of the grayscale frames, the pi camera capturing the luma plane unless given
+        if source is None:
+            source = PiCameraSource(camera_resolution, frame_rate, zoom)
+        self.source = source
+        # resolution of the live frames, stills are taken at source.resolution
+        self.resolution = source.stream_resolution
+        # ring of preallocated grayscale frames. captures are written to the slot after the newest frame
+        # so a frame handed out without copying stays intact for buffer_size - 1 more captures
+        self._frames = [np.empty((self.resolution[1], self.resolution[0]), dtype=np.uint8)
+                        for _ in range(buffer_size)]
+        self._frame_times = [0.0] * buffer_size
+        # slot of the newest frame
+        self._newest = 0
+        # sequence number of the newest frame, grows by one with every capture (0 means no capture yet)
+        self._sequence = 0
+        # a lock to prevent publishing a frame and reading the newest frame at the same time
         self.picture_lock = threading.Lock()
+        # notified when a new frame is published
+        self.new_frame = threading.Condition(self.picture_lock)
         # flag that indicates whether camera is capturing pictures
         self.is_capturing = False
-        self.cam.framerate = frame_rate
-        self.raw_capture = PiRGBArray(self.cam, size=camera_resolution)
         self.capture_time = time.time()
+        # moving average of the achieved frame rate
+        self.fps = 0.0
         time.sleep(0.5)
 
+    def _next_slot(self):
+        # the slot the next capture is written to, only the capturing thread writes to it
+        return (self._newest + 1) % len(self._frames)
+
+    def _publish(self, slot, capture_time):
+        """
+        makes the frame in slot the newest frame and wakes up waiting consumers
+        :param slot: slot that holds the new frame
+        :param capture_time: time the frame was captured
+        :return: None
+        """
+        with self.new_frame:
+            if self._sequence and capture_time > self.capture_time:
+                self.fps = 0.9 * self.fps + 0.1 / (capture_time - self.capture_time) if self.fps \
+                    else 1 / (capture_time - self.capture_time)
+            self._newest = slot
+            self._frame_times[slot] = capture_time
+            self.capture_time = capture_time
+            self._sequence += 1
+            self.new_frame.notify_all()
+        if self._sequence % FPS_LOG_INTERVAL == 0:
+            logging.info(f"camera: {self.fps:.1f} fps")
+
+    def _get_newest(self):
+        # must be called with the picture lock held
+        view = self._frames[self._newest].view()
+        view.flags.writeable = False
+        return view, self._sequence, self._frame_times[self._newest]
+
     def retrieve_image(self):
         """
-        retrieves the current image in a threading safe manenr
+        retrieves a copy of the current image in a threading safe manenr
         :return: numpy array that holds image
         """
         self.picture_lock.acquire(blocking=True)
-        im = self._image.copy()
+        im = self._frames[self._newest].copy()
         self.picture_lock.release()
         return im
 
+    def get_frame(self):
+        """
+        gets the newest frame without copying it.
+        the frame is a read only view that stays intact for buffer_size - 1 more captures,
+        copy it if it is needed for longer.
+        :return: numpy array (read only), sequence number, capture time
+        """
+        with self.picture_lock:
+            return self._get_newest()
+
+    def wait_for_frame(self, last_sequence, timeout=None):
+        """
+        blocks until there is a frame newer than last_sequence
+        :param last_sequence: sequence number of the last frame the caller used
+        :param timeout: seconds to wait, None to wait forever
+        :return: (numpy array (read only), sequence number, capture time) like get_frame, None on timeout
+        """
+        with self.new_frame:
+            if not self.new_frame.wait_for(lambda: self._sequence > last_sequence, timeout):
+                return None
+            return self._get_newest()
+
+    def get_sequence(self):
+        """
+        gets the sequence number of the newest frame
+        :return: int
+        """
+        return self._sequence
+
+    def get_fps(self):
+        """
+        gets the achieved frame rate of the capture
+        :return: float
+        """
+        return self.fps
+
     def take_image(self):
         """
         takes a single image in a threading safe manner
         :return: numpy array that contains image
         """
-        self.picture_lock.acquire(blocking=True)
-        self.cam.capture(self._bgr_image, 'bgr')
-        self._image = cv2.cvtColor(self._bgr_image.reshape(
-            (self.cam.resolution[1], self.cam.resolution[0], 3)),
-                                   cv2.COLOR_BGR2GRAY)
-        self.picture_lock.release()
+        slot = self._next_slot()
+        np.copyto(self._frames[slot], self.source.grab())
+        self._publish(slot, time.time())
+
+    def capture_still(self):
+        """
+        takes a single image at the full resolution of the source, the live frames may be downscaled
+        :return: numpy array that contains image
+        """
+        return self.source.capture_still().copy()
 
     def live_capture(self):
         """
@@ -58,12 +142,7 @@ class Camera:
         :return: None
         """
         while self.is_capturing:
-            self.picture_lock.acquire(blocking=True)
-            self.cam.capture(self._bgr_image, 'bgr')
-            self._image = cv2.cvtColor(self._bgr_image.reshape(
-            (self.cam.resolution[1], self.cam.resolution[0], 3)),
-                                   cv2.COLOR_BGR2GRAY)
-            self.picture_lock.release()
+            self.take_image()
 
     def save_image(self, name):
         """
@@ -71,9 +150,7 @@ class Camera:
         :param name: path to file to save to
         :return: None
         """
-        cv2.imwrite(name, self._bgr_image.reshape(
-            (self.cam.resolution[1], self.cam.resolution[0], 3)))
-        cv2.imwrite("gray_" + name, self._image)
+        cv2.imwrite(name, self.retrieve_image())
 
     def start_live_capture(self):
         """
@@ -94,18 +171,12 @@ class Camera:
         t.start()
 
     def live_video_capture(self):
-        for frame in self.cam.capture_continuous(self.raw_capture, format="bgr", use_video_port=True):
-            # grab the raw NumPy array representing the image, then initialize the timestamp
-            # and occupied/unoccupied text
-            self.picture_lock.acquire()
-            self._image = cv2.cvtColor(frame.array.reshape(
-                (self.cam.resolution[1], self.cam.resolution[0], 3)),
-                cv2.COLOR_BGR2GRAY)
-            self.capture_time = time.time()
-            self.picture_lock.release()
-            # show the frame
-
-            self.raw_capture.truncate(0)
+        for frame in self.source.frames():
+            # copy the grayscale frame straight into the next slot, the lock is only taken to publish it
+            slot = self._next_slot()
+            np.copyto(self._frames[slot], frame)
+            self._publish(slot, time.time())
+
             if not self.is_capturing:
                 break
 
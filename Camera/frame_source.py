@@ -0,0 +1,260 @@
+import glob
+import threading
+import time
+import numpy as np
+import cv2
+
+"""
+Frame sources module
+
+sources of grayscale frames for the camera. the camera captures from a source in its own thread,
+so the same pipeline runs from the raspberry pi camera or from a recorded video or image sequence
+on a machine with no camera.
+"""
+
+
+class FrameSource(object):
+    """
+    interface of a source of grayscale frames.
+    stills are captured at the full resolution, the live frames may be downscaled to a
+    lower stream resolution to track faster.
+    """
+    def __init__(self, resolution, stream_resolution=None):
+        # (width, height) of the stills
+        self.resolution = resolution
+        # (width, height) of the live frames
+        self.stream_resolution = stream_resolution or resolution
+
+    def frames(self):
+        """
+        generator of grayscale frames (height x width, uint8).
+        a yielded frame may be overwritten by the next one, copy it to keep it.
+        :return: generator of numpy arrays
+        """
+        raise NotImplementedError
+
+    def grab(self):
+        """
+        captures a single grayscale frame at the stream resolution
+        :return: numpy array
+        """
+        raise NotImplementedError
+
+    def capture_still(self):
+        """
+        captures a single grayscale frame at the full resolution
+        :return: numpy array
+        """
+        return self.grab()
+
+    def close(self):
+        """
+        releases the source
+        :return: None
+        """
+        pass
+
+
+class PiCameraSource(FrameSource):
+    """
+    frames from the raspberry pi camera.
+    "yuv" reads the luma (Y) plane of a YUV capture which already is the grayscale image,
+    "bgr" captures BGR and converts it to grayscale.
+    """
+    def __init__(self, resolution, frame_rate, zoom, capture_format="yuv", stream_resolution=None):
+        # imported here so the camera module can be used without the pi camera libraries
+        from picamera import PiCamera
+        super().__init__(resolution, stream_resolution)
+        self.capture_format = capture_format
+        self.cam = PiCamera()
+        self.cam.zoom = zoom
+        self.cam.resolution = resolution
+        self.cam.framerate = frame_rate
+        # live frames are downscaled by the camera's resizer, None keeps the full resolution
+        self._resize = None if self.stream_resolution == tuple(resolution) else self.stream_resolution
+        self._stream_buffers = self._allocate(self.stream_resolution)
+        # stills get their own buffers so they never overwrite a live frame that is being captured
+        self._still_buffers = self._allocate(resolution)
+
+    def _allocate(self, resolution):
+        width, height = resolution
+        # the camera pads YUV frames to multiples of 32 columns and 16 rows
+        padded = ((width + 31) // 32 * 32, (height + 15) // 16 * 16)
+        # Y plane followed by the quarter size U and V planes
+        yuv = np.empty((padded[0] * padded[1] * 3 // 2,), dtype=np.uint8)
+        bgr = np.empty((height * width * 3,), dtype=np.uint8)
+        gray = np.empty((height, width), dtype=np.uint8)
+        return resolution, padded, yuv, bgr, gray
+
+    def _luma(self, buffers):
+        (width, height), (padded_width, padded_height), yuv, _, _ = buffers
+        return yuv[:padded_width * padded_height].reshape((padded_height, padded_width))[:height, :width]
+
+    def _bgr_to_gray(self, buffers, bgr):
+        (width, height), _, _, _, gray = buffers
+        return cv2.cvtColor(bgr.reshape((height, width, 3)), cv2.COLOR_BGR2GRAY, dst=gray)
+
+    def _capture(self, buffers, resize, **kwargs):
+        if self.capture_format == "yuv":
+            self.cam.capture(buffers[2], "yuv", resize=resize, **kwargs)
+            return self._luma(buffers)
+        self.cam.capture(buffers[3], "bgr", resize=resize, **kwargs)
+        return self._bgr_to_gray(buffers, buffers[3])
+
+    def frames(self):
+        if self.capture_format == "yuv":
+            for _ in self.cam.capture_continuous(self._stream_buffers[2], format="yuv", use_video_port=True,
+                                                 resize=self._resize):
+                yield self._luma(self._stream_buffers)
+        else:
+            from picamera.array import PiRGBArray
+            raw_capture = PiRGBArray(self.cam, size=self.stream_resolution)
+            for frame in self.cam.capture_continuous(raw_capture, format="bgr", use_video_port=True,
+                                                     resize=self._resize):
+                yield self._bgr_to_gray(self._stream_buffers, frame.array)
+                raw_capture.truncate(0)
+
+    def grab(self):
+        return self._capture(self._stream_buffers, self._resize)
+
+    def capture_still(self):
+        # a second splitter port of the video port so stills can be taken while the live frames stream
+        return self._capture(self._still_buffers, None, use_video_port=True, splitter_port=1)
+
+    def close(self):
+        self.cam.close()
+
+
+class _ReplaySource(FrameSource):
+    """
+    base of the sources that replay recorded frames, optionally at a fixed frame rate
+    """
+    def __init__(self, resolution, frame_rate=None, loop=True, stream_resolution=None):
+        super().__init__(resolution, stream_resolution)
+        self.frame_rate = frame_rate
+        self.loop = loop
+        self._last_frame_time = 0
+        # stills may be taken from another thread than the live frames
+        self._read_lock = threading.Lock()
+
+    def _read(self):
+        """
+        reads the next recorded frame
+        :return: numpy array (grayscale), None when the recording ended
+        """
+        raise NotImplementedError
+
+    def _rewind(self):
+        raise NotImplementedError
+
+    def _throttle(self):
+        # keeps the frames at the recorded frame rate
+        if self.frame_rate:
+            wait = self._last_frame_time + 1 / self.frame_rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        self._last_frame_time = time.time()
+
+    def _next(self):
+        with self._read_lock:
+            frame = self._read()
+            if frame is None and self.loop:
+                self._rewind()
+                frame = self._read()
+        if frame is None:
+            raise RuntimeError("no frames left in recording")
+        return frame
+
+    def grab(self):
+        frame = self._next()
+        if self.stream_resolution != self.resolution:
+            frame = cv2.resize(frame, self.stream_resolution, interpolation=cv2.INTER_AREA)
+        self._throttle()
+        return frame
+
+    def capture_still(self):
+        return self._next()
+
+    def frames(self):
+        while True:
+            try:
+                yield self.grab()
+            except RuntimeError:
+                return
+
+
+class VideoSource(_ReplaySource):
+    """
+    frames from a recorded video, or an image sequence pattern such as "frames/%04d.png"
+    """
+    def __init__(self, path, frame_rate=None, loop=True, stream_resolution=None):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"could not open video: {path}")
+        resolution = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                      int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        super().__init__(resolution, frame_rate, loop, stream_resolution)
+
+    def _read(self):
+        success, frame = self.capture.read()
+        if not success:
+            return None
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return frame
+
+    def _rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        self.capture.release()
+
+
+class ImageSequenceSource(_ReplaySource):
+    """
+    frames from a list of image files or a glob pattern, read straight as grayscale
+    """
+    def __init__(self, paths, frame_rate=None, loop=True, stream_resolution=None):
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(paths))
+        if not paths:
+            raise RuntimeError("no images to replay")
+        self.paths = list(paths)
+        self._index = 0
+        first = cv2.imread(self.paths[0], cv2.IMREAD_GRAYSCALE)
+        if first is None:
+            raise RuntimeError(f"could not read image: {self.paths[0]}")
+        super().__init__((first.shape[1], first.shape[0]), frame_rate, loop, stream_resolution)
+
+    def _read(self):
+        if self._index >= len(self.paths):
+            return None
+        frame = cv2.imread(self.paths[self._index], cv2.IMREAD_GRAYSCALE)
+        self._index += 1
+        return frame
+
+    def _rewind(self):
+        self._index = 0
+
+
+def create_frame_source(name, resolution, frame_rate, zoom, capture_format="yuv", path=None,
+                        stream_resolution=None):
+    """
+    creates a frame source by its name
+    :param name: "picamera", "video" or "images"
+    :param resolution: (width, height) of the pi camera
+    :param frame_rate: frame rate of the pi camera, also the replay rate of recordings
+    :param zoom: zoom of the pi camera
+    :param capture_format: "yuv" or "bgr" capture of the pi camera
+    :param path: recording to replay for "video" and "images"
+    :param stream_resolution: (width, height) of the live frames, None for the full resolution
+    :return: FrameSource
+    """
+    if name == "picamera":
+        return PiCameraSource(resolution, frame_rate, zoom, capture_format, stream_resolution)
+    if name == "video":
+        return VideoSource(path, frame_rate, stream_resolution=stream_resolution)
+    if name == "images":
+        return ImageSequenceSource(path, frame_rate, stream_resolution=stream_resolution)
+    raise ValueError(f"unknown frame source: {name}")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Distance field methods
+
+computes the cost of the cheapest path from every maze cord to a target cord with a single
+wavefront over the maze. the field is an exact heuristic for the search agents and a path
+from any cord can be read from it by walking down its gradient.
+"""
+
+import numpy as np
+
+# distance of cords that can not reach the target
+UNREACHABLE = np.iinfo(np.uint32).max
+
+
+def compute_distance_field(on_maze, target, action_vectors, action_costs):
+    """
+    runs a wavefront from the target over the maze. costs are integers so the wavefront is
+    processed one cost level at a time (dial's algorithm) and every level is relaxed with numpy.
+    :param on_maze: boolean mask of the maze
+    :param target: (row, col) to compute the distances to
+    :param action_vectors: dict mapping action name to (row delta, col delta)
+    :param action_costs: dict mapping action name to its integer cost
+    :return: numpy array (uint32) of distances, UNREACHABLE where the target can not be reached
+    """
+    rows, cols = on_maze.shape
+    # pad so neighbours of every cord are inside the image
+    padded = np.pad(on_maze, 1).ravel()
+    padded_cols = cols + 2
+    dist = np.full(padded.shape, UNREACHABLE, dtype=np.uint32)
+    moves = [(vector[0] * padded_cols + vector[1], action_costs[name]) for name, vector in action_vectors.items()]
+
+    target_row, target_col = target
+    if 0 <= target_row < rows and 0 <= target_col < cols and on_maze[target_row, target_col]:
+        target_cell = (target_row + 1) * padded_cols + target_col + 1
+        dist[target_cell] = 0
+        # buckets[cost] = arrays of cells that were given that cost
+        buckets = {0: [np.array([target_cell])]}
+        while buckets:
+            level = min(buckets)
+            cells = np.concatenate(buckets.pop(level))
+            # cells that got a lower cost after being put in this bucket
+            cells = np.unique(cells[dist[cells] == level])
+            for offset, cost in moves:
+                next_cells = cells + offset
+                new_dist = level + cost
+                next_cells = next_cells[np.logical_and(padded[next_cells], dist[next_cells] > new_dist)]
+                if len(next_cells):
+                    dist[next_cells] = new_dist
+                    buckets.setdefault(new_dist, []).append(next_cells)
+
+    return dist.reshape(rows + 2, cols + 2)[1:-1, 1:-1].copy()
+
+
+def follow_distance_field(field, start, action_vectors, action_costs):
+    """
+    walks down the gradient of a distance field from start to its target
+    :param field: distance field from compute_distance_field
+    :param start: (row, col) to start from
+    :param action_vectors: dict mapping action name to (row delta, col delta)
+    :param action_costs: dict mapping action name to its integer cost
+    :return: list of actions, None if the target can not be reached from start
+    """
+    rows, cols = field.shape
+    row, col = start
+    if not (0 <= row < rows and 0 <= col < cols) or field[row, col] == UNREACHABLE:
+        return None
+    actions = []
+    current = int(field[row, col])
+    while current != 0:
+        for name, (d_row, d_col) in action_vectors.items():
+            new_row, new_col = row + d_row, col + d_col
+            if 0 <= new_row < rows and 0 <= new_col < cols \
+                    and int(field[new_row, new_col]) + action_costs[name] == current:
+                break
+        else:
+            return None
+        actions.append(name)
+        row, col = new_row, new_col
+        current = int(field[row, col])
+    return actions
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Maze cache methods and classes
+
+keeps processed mazes on disk so an unchanged board does not need to be processed again.
+entries are keyed by a perceptual hash of the downsampled camera frame, frames whose hashes differ
+by only a few bits (camera noise, small lighting changes) find the same entry.
+every entry is a directory of .npy files that are memory mapped when the entry is loaded.
+"""
+
+import json
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+
+# file of an entry that holds its hash, settings and metadata
+META_FILE = "meta.json"
+
+
+def perceptual_hash(img, hash_size=8):
+    """
+    dct hash of an image. the image is downsampled and its lowest frequencies are compared to their median,
+    so noise and small lighting changes flip only a few bits
+    :param img: grayscale image
+    :param hash_size: the hash has hash_size * hash_size bits
+    :return: int
+    """
+    small = cv2.resize(img, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size].ravel()
+    # the first coefficient is the mean brightness
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count("1")
+
+
+class MazeCache(object):
+    """
+    on disk cache of processed mazes with a size limit, the least recently used entries are evicted first
+    """
+    def __init__(self, directory, max_bytes, max_distance=6, hash_size=8):
+        """
+        :param directory: directory to keep the entries in
+        :param max_bytes: size limit of all the entries
+        :param max_distance: largest hamming distance between hashes of frames of the same board
+        :param hash_size: the hashes have hash_size * hash_size bits
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, img):
+        """
+        gets the key of a camera frame
+        :param img: grayscale camera frame
+        :return: int
+        """
+        return perceptual_hash(img, self.hash_size)
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(path, META_FILE)) as meta_file:
+                    yield path, json.load(meta_file)
+            except (OSError, ValueError):
+                continue
+
+    def lookup(self, img, settings, accept=None):
+        """
+        finds the entry of the board in a camera frame
+        :param img: grayscale camera frame
+        :param settings: settings the entry must have been processed with
+        :param accept: function (metadata) -> bool that checks an entry with a close hash is of the same board,
+                       such as that the board did not move. None accepts every close entry
+        :return: (entry path, dict of memory mapped arrays, metadata) or None if the board is not cached
+        """
+        key = self.get_key(img)
+        candidates = []
+        for path, meta in self._entries():
+            if meta["settings"] != settings or tuple(meta["shape"]) != img.shape[:2]:
+                continue
+            distance = hamming_distance(key, int(meta["key"], 16))
+            if distance <= self.max_distance:
+                candidates.append((distance, path, meta))
+        # the closest hash first
+        candidates.sort(key=lambda candidate: candidate[0])
+        best = next((candidate for candidate in candidates if accept is None or accept(candidate[2])), None)
+        if best is None:
+            return None
+        _, path, meta = best
+        try:
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+        except (OSError, ValueError):
+            return None
+        # marks the entry as recently used
+        os.utime(os.path.join(path, META_FILE))
+        return path, arrays, meta
+
+    def store(self, img, settings, arrays, meta=None):
+        """
+        stores a processed board
+        :param img: grayscale camera frame the board was processed from
+        :param settings: settings the board was processed with
+        :param arrays: dict mapping name to numpy array
+        :param meta: extra metadata (json serializable)
+        :return: path of the entry
+        """
+        key = self.get_key(img)
+        path = os.path.join(self.directory, f"{key:0{self.hash_size * self.hash_size // 4}x}-{time.time_ns()}")
+        os.makedirs(path)
+        meta = dict(meta or {}, key=f"{key:x}", settings=settings, shape=list(img.shape[:2]), arrays=[])
+        self._write(path, arrays, meta)
+        self.evict()
+        return path
+
+    def update(self, path, arrays, meta=None):
+        """
+        adds arrays to an entry, such as indexes built after the entry was stored
+        :param path: path of the entry
+        :param arrays: dict mapping name to numpy array
+        :param meta: metadata to update
+        :return: None
+        """
+        try:
+            with open(os.path.join(path, META_FILE)) as meta_file:
+                current = json.load(meta_file)
+        except (OSError, ValueError):
+            # the entry was evicted
+            return
+        current.update(meta or {})
+        self._write(path, arrays, current)
+        self.evict()
+
+    def _write(self, path, arrays, meta):
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array))
+        meta["arrays"] = sorted(set(meta["arrays"]) | set(arrays))
+        # the metadata is written last so an entry is only found once all its arrays are written
+        temp_file = os.path.join(path, META_FILE + ".tmp")
+        with open(temp_file, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_file, os.path.join(path, META_FILE))
+
+    def evict(self):
+        """
+        removes the least recently used entries until the cache fits its size limit
+        :return: None
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            meta_file = os.path.join(path, META_FILE)
+            last_used = os.path.getmtime(meta_file) if os.path.exists(meta_file) else 0
+            entries.append((last_used, size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
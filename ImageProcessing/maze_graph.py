@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Skeleton graph methods and classes
+
+compresses the one pixel wide skeleton of the maze into a weighted graph.
+nodes are the skeleton pixels that do not have exactly two neighbours (junctions and dead ends),
+pixels with exactly two neighbours are folded into the edges between the nodes.
+every edge keeps its polyline of pixels so paths on the graph can be expanded back to pixels.
+"""
+
+import cv2
+import numpy as np
+
+# kinds of graph nodes
+DEAD_END = "dead_end"
+JUNCTION = "junction"
+ISOLATED = "isolated"
+# node picked on a closed loop of the skeleton that has no junction or dead end
+CYCLE = "cycle"
+NODE_KINDS = [DEAD_END, JUNCTION, ISOLATED, CYCLE]
+
+# 8-connected neighbourhood used to count the neighbours of a pixel
+NEIGHBOURS_KERNEL = np.array([[1, 1, 1],
+                              [1, 0, 1],
+                              [1, 1, 1]], dtype=np.float32)
+
+
+class MazeGraph(object):
+    """
+    weighted graph of the skeleton.
+    cells are flat indices (row * cols + col) of the skeleton image.
+    """
+    def __init__(self, shape, node_cells, node_kinds, edge_nodes, edge_costs, edge_paths):
+        """
+        :param shape: (rows, cols) of the skeleton image
+        :param node_cells: list of flat cells of the nodes
+        :param node_kinds: list of node kinds
+        :param edge_nodes: list of (node id, node id) of the edges
+        :param edge_costs: list of edge costs
+        :param edge_paths: list of lists of flat cells from the first node of the edge to the second
+        """
+        self.shape = shape
+        self.node_cells = node_cells
+        self.node_kinds = node_kinds
+        self.edge_nodes = edge_nodes
+        self.edge_costs = edge_costs
+        self.edge_paths = edge_paths
+        self.node_of_cell = {cell: node for node, cell in enumerate(node_cells)}
+        # adjacency[node] = [(neighbour node, cost, edge index)]
+        self.adjacency = [[] for _ in node_cells]
+        for edge, (u, v) in enumerate(edge_nodes):
+            self.adjacency[u].append((v, edge_costs[edge], edge))
+            self.adjacency[v].append((u, edge_costs[edge], edge))
+
+    def get_node_count(self):
+        return len(self.node_cells)
+
+    def get_edge_count(self):
+        return len(self.edge_nodes)
+
+    def get_node_point(self, node):
+        """
+        gets the location of a node
+        :param node: node id
+        :return: (row, col)
+        """
+        return divmod(self.node_cells[node], self.shape[1])
+
+    def to_arrays(self):
+        """
+        packs the graph into flat arrays, edge paths are concatenated with their start offsets
+        :return: dict mapping name to numpy array
+        """
+        lengths = [len(path) for path in self.edge_paths]
+        return {
+            "graph_shape": np.array(self.shape, dtype=np.int64),
+            "graph_node_cells": np.array(self.node_cells, dtype=np.int64),
+            "graph_node_kinds": np.array([NODE_KINDS.index(kind) for kind in self.node_kinds], dtype=np.uint8),
+            "graph_edge_nodes": np.array(self.edge_nodes, dtype=np.int64).reshape(-1, 2),
+            "graph_edge_costs": np.array(self.edge_costs, dtype=np.int64),
+            "graph_path_offsets": np.cumsum([0] + lengths, dtype=np.int64),
+            "graph_path_cells": np.array([cell for path in self.edge_paths for cell in path], dtype=np.int64),
+        }
+
+    @staticmethod
+    def from_arrays(arrays):
+        """
+        unpacks a graph packed by to_arrays
+        :param arrays: dict mapping name to numpy array
+        :return: MazeGraph
+        """
+        offsets = arrays["graph_path_offsets"].tolist()
+        cells = arrays["graph_path_cells"].tolist()
+        return MazeGraph(tuple(arrays["graph_shape"].tolist()),
+                         arrays["graph_node_cells"].tolist(),
+                         [NODE_KINDS[kind] for kind in arrays["graph_node_kinds"].tolist()],
+                         [tuple(nodes) for nodes in arrays["graph_edge_nodes"].tolist()],
+                         arrays["graph_edge_costs"].tolist(),
+                         [cells[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+
+    def get_edge_path(self, edge, from_node):
+        """
+        gets the cells of an edge ordered from one of its nodes to the other
+        :param edge: edge index
+        :param from_node: the node to start the path from
+        :return: list of flat cells
+        """
+        path = self.edge_paths[edge]
+        if self.edge_nodes[edge][0] == from_node:
+            return path
+        return path[::-1]
+
+
+def build_maze_graph(skeleton, action_vectors, action_costs, maze_color=255):
+    """
+    builds the junction graph of a skeletonized maze
+    :param skeleton: skeleton image, maze pixels have the value maze_color
+    :param action_vectors: dict mapping action name to (row delta, col delta)
+    :param action_costs: dict mapping action name to its cost
+    :param maze_color: value of the maze pixels
+    :return: MazeGraph
+    """
+    rows, cols = skeleton.shape
+    # pad so the neighbours of every skeleton pixel are inside the image
+    padded = np.pad(skeleton == maze_color, 1)
+    padded_cols = cols + 2
+    degree = cv2.filter2D(padded.astype(np.uint8), -1, NEIGHBOURS_KERNEL, borderType=cv2.BORDER_CONSTANT)
+    offsets = [(vector[0] * padded_cols + vector[1], action_costs[name])
+               for name, vector in action_vectors.items()]
+
+    on_maze = set(np.flatnonzero(padded).tolist())
+    degree = degree.ravel()
+
+    def to_cell(padded_cell):
+        row, col = divmod(padded_cell, padded_cols)
+        return (row - 1) * cols + (col - 1)
+
+    def neighbours(cell):
+        return [(cell + offset, cost) for offset, cost in offsets if cell + offset in on_maze]
+
+    node_cells = []
+    node_kinds = []
+    node_of_cell = {}
+
+    def add_node(cell, kind):
+        node_of_cell[cell] = len(node_cells)
+        node_cells.append(cell)
+        node_kinds.append(kind)
+
+    for cell in sorted(on_maze):
+        if degree[cell] == 0:
+            add_node(cell, ISOLATED)
+        elif degree[cell] == 1:
+            add_node(cell, DEAD_END)
+        elif degree[cell] > 2:
+            add_node(cell, JUNCTION)
+
+    edge_nodes = []
+    edge_costs = []
+    edge_paths = []
+    # pixels with two neighbours that are already part of an edge
+    traced = set()
+
+    def trace_edges(start):
+        for first, cost in neighbours(start):
+            if first in node_of_cell:
+                # adjacent nodes, add the edge once
+                if start < first:
+                    edge_nodes.append((node_of_cell[start], node_of_cell[first]))
+                    edge_costs.append(cost)
+                    edge_paths.append([start, first])
+                continue
+            if first in traced:
+                continue
+            path = [start, first]
+            total = cost
+            previous, current = start, first
+            while current not in node_of_cell:
+                traced.add(current)
+                # a pixel with two neighbours has one way forward
+                current_neighbours = neighbours(current)
+                next_cell, step_cost = next((n, c) for n, c in current_neighbours if n != previous)
+                total += step_cost
+                path.append(next_cell)
+                previous, current = current, next_cell
+            # a loop back to the same node never shortens a path
+            if current != start:
+                edge_nodes.append((node_of_cell[start], node_of_cell[current]))
+                edge_costs.append(total)
+                edge_paths.append(path)
+
+    for cell in list(node_cells):
+        trace_edges(cell)
+
+    # closed loops without junctions or dead ends get a node of their own
+    for cell in sorted(on_maze):
+        if cell not in node_of_cell and cell not in traced:
+            add_node(cell, CYCLE)
+            trace_edges(cell)
+
+    return MazeGraph((rows, cols),
+                     [to_cell(cell) for cell in node_cells],
+                     node_kinds,
+                     edge_nodes,
+                     edge_costs,
+                     [[to_cell(cell) for cell in path] for path in edge_paths])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Path simplification methods
+
+turns the cord path of a search into the fewest straight segments the car can drive.
+segments are found with ramer-douglas-peucker: a segment replaces the part of the path between
+its ends if no cord of that part is further than the tolerance from it and the segment stays
+inside a corridor around the maze lines. otherwise it is split at the furthest cord.
+"""
+
+import cv2
+import numpy as np
+
+
+def get_corridor(maze_mask, width):
+    """
+    gets the area the car may drive in
+    :param maze_mask: boolean mask of the maze lines
+    :param width: pixels the car may leave the lines by
+    :return: boolean mask
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * width + 1, 2 * width + 1))
+    return cv2.dilate(maze_mask.astype(np.uint8), kernel).astype(bool)
+
+
+def segment_in_corridor(corridor, start, end):
+    """
+    checks that every pixel of a segment is inside the corridor
+    :param corridor: boolean mask
+    :param start: (row, col)
+    :param end: (row, col)
+    :return: bool
+    """
+    steps = int(max(abs(end[0] - start[0]), abs(end[1] - start[1]))) + 1
+    rows = np.rint(np.linspace(start[0], end[0], steps)).astype(np.intp)
+    cols = np.rint(np.linspace(start[1], end[1], steps)).astype(np.intp)
+    return bool(corridor[rows, cols].all())
+
+
+def distances_from_segment(points, start, end):
+    """
+    distances of points from the line through a segment
+    :param points: numpy array of (row, col)
+    :return: numpy array
+    """
+    direction = end - start
+    length = np.hypot(direction[0], direction[1])
+    offsets = points - start
+    if length == 0:
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+    return np.abs(offsets[:, 0] * direction[1] - offsets[:, 1] * direction[0]) / length
+
+
+def simplify_path(cords, corridor, tolerance):
+    """
+    simplifies a cord path into straight segments
+    :param cords: list of (row, col), such as from MazeSearchEnv.actions_to_cords
+    :param corridor: boolean mask of the area the segments must stay in, None to not check
+    :param tolerance: largest distance in pixels of a cord from the segment that replaces it
+    :return: list of (row, col) of the segment ends, starting with the first cord and ending with the last
+    """
+    points = np.asarray(cords, dtype=np.float64)
+    if len(points) < 3:
+        return [tuple(cord) for cord in cords]
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    # parts of the path that were not simplified yet, (first index, last index)
+    parts = [(0, len(points) - 1)]
+    while parts:
+        first, last = parts.pop()
+        if last - first < 2:
+            continue
+        distances = distances_from_segment(points[first + 1:last], points[first], points[last])
+        furthest = first + 1 + int(np.argmax(distances))
+        if distances[furthest - first - 1] <= tolerance and \
+                (corridor is None or segment_in_corridor(corridor, points[first], points[last])):
+            continue
+        keep[furthest] = True
+        parts.append((first, furthest))
+        parts.append((furthest, last))
+    return [tuple(int(value) for value in cords[index]) for index in np.flatnonzero(keep)]
+
+
+def segments_to_directions(turns, action_vectors):
+    """
+    gets the directions of the segments between turns
+    :param turns: list of (row, col), such as from simplify_path
+    :param action_vectors: dict mapping action name to (row delta, col delta)
+    :return: list of (action name closest to the segment's direction, length of the segment)
+    """
+    directions = []
+    for start, end in zip(turns, turns[1:]):
+        delta = (end[0] - start[0], end[1] - start[1])
+        length = np.hypot(delta[0], delta[1])
+        action = max(action_vectors, key=lambda name: (action_vectors[name][0] * delta[0] +
+                                                       action_vectors[name][1] * delta[1]) /
+                     np.hypot(*action_vectors[name]))
+        directions.append((action, int(round(length))))
+    return directions
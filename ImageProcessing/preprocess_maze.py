@@ -7,12 +7,20 @@
 Maze preprocess methods and classes
 """
 
+import os
 import cv2
 import math
+import time
+import queue
+import logging
+import threading
 import numpy as np
-from skimage.morphology import skeletonize
 
 from config import Config
+from metrics import metrics
+from ImageProcessing.maze_graph import MazeGraph, build_maze_graph
+from ImageProcessing.distance_field import compute_distance_field
+from ImageProcessing.thinning import zhang_suen_thinning
 
 # value to use for the maze lines
 MAZE_COLOR = 255
@@ -61,6 +69,55 @@ def cyclic_intersection_pts(pts):
 
 
 def get_best_fit_quad(contour):
+    """
+    finds the maximum area quadrilateral with corners on the convex hull of a contour.
+    for a diagonal (i, k) the best corner on each side of it is the hull point farthest from the diagonal,
+    and it only moves forward along the hull while k moves forward, so both corners are found with
+    rotating pointers in O(h^2) for h hull points instead of trying every four points.
+    :param contour: contour to fit
+    :return: numpy array of the 4 corners (x, y)
+    """
+    hull = cv2.convexHull(contour, False).reshape(-1, 2).tolist()
+    n = len(hull)
+    if n < 4:
+        return get_best_fit_quad_brute_force(contour)
+    # twice the area of the hull, its sign is the orientation of the hull points
+    orientation = 1 if sum(hull[i - 1][0] * hull[i][1] - hull[i][0] * hull[i - 1][1] for i in range(n)) > 0 else -1
+
+    def area(a, b, c):
+        # twice the area of the triangle of hull points a, b, c (indices wrap around the hull)
+        (x1, y1), (x2, y2), (x3, y3) = hull[a % n], hull[b % n], hull[c % n]
+        return orientation * ((x2 - x1) * (y3 - y1) - (y2 - y1) * (x3 - x1))
+
+    best_area = 0
+    best_corners = None
+    for i in range(n - 3):
+        j = i + 1
+        l = i + 3
+        for k in range(i + 2, n - 1):
+            # farthest point from the diagonal between i and k
+            while j + 1 < k and area(i, j + 1, k) >= area(i, j, k):
+                j += 1
+            # farthest point from the diagonal between k and i
+            l = max(l, k + 1)
+            while l + 1 < n and area(i, k, l + 1) >= area(i, k, l):
+                l += 1
+            a = area(i, j, k) + area(i, k, l)
+            if a > best_area:
+                best_area = a
+                best_corners = (i, j, k, l)
+    if best_corners is None:
+        return np.array([])
+    return np.array([tuple(hull[corner]) for corner in best_corners])
+
+
+def get_best_fit_quad_brute_force(contour):
+    """
+    finds the maximum area quadrilateral on the convex hull of a contour by trying every four hull points.
+    O(h^4), kept as a reference for get_best_fit_quad
+    :param contour: contour to fit
+    :return: numpy array of the 4 corners (x, y)
+    """
     hull = cv2.convexHull(contour, False)
     best_points = []
     best_area = 0
@@ -125,7 +182,21 @@ def warp_image_saved_matrix(img, m):
 
 def threshold_image(img):
     """
-    thresholds an image with a maze and returns the image and the mask for the maze
+    thresholds an image with a maze and returns the image and the mask for the maze.
+    the segmentation is selected by Config.threshold_mode
+    :param img: image to threshold
+    :return: numpy array (thresholded image), numpy array (mask)
+    """
+    if Config.threshold_mode == "full":
+        return threshold_image_full(img)
+    if Config.threshold_mode == "downsampled":
+        return threshold_image_downsampled(img, Config.threshold_downsample)
+    raise ValueError(f"unknown threshold mode: {Config.threshold_mode}")
+
+
+def threshold_image_full(img):
+    """
+    thresholds an image with a maze using an adaptive threshold on the full image
     :param img: image to threshold
     :return: numpy array (thresholded image), numpy array (mask)
     """
@@ -149,6 +220,76 @@ def threshold_image(img):
     return final_thresh, mask
 
 
+def get_small_board_mask(img, factor):
+    """
+    finds the board on a downsampled image with the adaptive threshold of threshold_image_full
+    :param img: image of the board
+    :param factor: factor to downsample the image by
+    :return: numpy array (mask of the downsampled image), contour of the board in the downsampled image
+    """
+    small = cv2.resize(img, (img.shape[1] // factor, img.shape[0] // factor), interpolation=cv2.INTER_AREA)
+    # same windows as threshold_image_full, scaled down (kernel sizes must be odd)
+    blur = cv2.medianBlur(small, max(15 // factor, 1) | 1)
+    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY, max(2501 // factor, 3) | 1, -22)
+    contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Contour of maximum area
+    largest_contour = max(contours, key=cv2.contourArea)
+    small_mask = np.zeros_like(thresh)
+    cv2.drawContours(small_mask, [largest_contour], 0, 255, -1)
+    return small_mask, largest_contour
+
+
+def get_board_corners(img, factor):
+    """
+    finds the corners of the board on a downsampled image, used to check that a board has not moved
+    :param img: image of the board
+    :param factor: factor to downsample the image by
+    :return: numpy array of the 4 corners (x, y) in pixels of img
+    """
+    _, contour = get_small_board_mask(img, factor)
+    return get_best_fit_quad(contour).reshape(-1, 2).astype(np.float64) * factor
+
+
+def get_board_shift(corners, other_corners):
+    """
+    gets how far the board moved between two sets of its corners
+    :param corners: numpy array of the 4 corners (x, y), such as from get_board_corners
+    :param other_corners: numpy array of the 4 corners (x, y)
+    :return: largest distance in pixels of a corner from the closest of the other corners
+    """
+    distances = np.hypot(*(corners[:, None, :] - other_corners[None, :, :]).transpose(2, 0, 1))
+    return float(distances.min(axis=1).max())
+
+
+def threshold_image_downsampled(img, factor):
+    """
+    thresholds an image with a maze, finding the board on a downsampled image.
+    the adaptive threshold and the contour search run on the downsampled image, the board contour is scaled
+    back to build the mask and the lines are thresholded at full resolution only inside the board.
+    :param img: image to threshold
+    :param factor: factor to downsample the image by
+    :return: numpy array (thresholded image), numpy array (mask)
+    """
+    small_mask, _ = get_small_board_mask(img, factor)
+    # only the otsu value is needed, the lines are thresholded inside the board
+    otsu_value = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[0]
+    # interpolating the mask up places its edge between the downsampled pixels
+    mask = cv2.resize(small_mask, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_LINEAR)
+    mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+    # the downsampled pixels on the edge are partly background, which would be taken as lines.
+    # the outer margin is removed before upscaling so the lines are only searched for a full
+    # downsampled pixel inside the board
+    inner_small_mask = cv2.erode(small_mask, np.ones((3, 3), dtype=np.uint8))
+    inner_mask = cv2.resize(inner_small_mask, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
+    # lines are only searched for inside the board
+    x, y, width, height = cv2.boundingRect(inner_mask)
+    final_thresh = np.zeros(img.shape[:2], dtype=np.uint8)
+    board = (slice(y, y + height), slice(x, x + width))
+    final_thresh[board][np.logical_and(inner_mask[board] == 255, img[board] <= otsu_value)] = 255
+    return final_thresh, mask
+
+
 def fill_aruco(image, corners, extra=5):
     """
     fills the aruco on the image with the value 255
@@ -163,45 +304,213 @@ def fill_aruco(image, corners, extra=5):
                          ((int)(maxc[0]) + extra, (int)(maxc[1]) + extra), 255, -1)
 
 
-def skeletonize_image(image):
+def skeletonize_image(image, backend=None):
     """
-    skeletonizes the image
+    skeletonizes the image. only the bounding box of the maze is thinned.
     :param image: image to skeletonize
-    :return: new numpy array after skeletonizing
+    :param backend: "skimage", "opencv" (ximgproc thinning) or "lut" (lookup table thinning),
+                    Config.skeleton_backend if None
+    :return: new numpy array (uint8) after skeletonizing
+    """
+    backend = backend or Config.skeleton_backend
+    skeleton = np.zeros(image.shape, dtype=np.uint8)
+    points = cv2.findNonZero((image != 0).view(np.uint8))
+    if points is None:
+        return skeleton
+    x, y, width, height = cv2.boundingRect(points)
+    crop = image[y:y + height, x:x + width] != 0
+    if backend == "opencv" and not hasattr(cv2, "ximgproc"):
+        # ximgproc is only in the opencv contrib packages
+        logging.warning("cv2.ximgproc is not available, using the lookup table thinning")
+        backend = "lut"
+    if backend == "skimage":
+        # imported here so importing this module does not pay for loading skimage
+        from skimage.morphology import skeletonize
+        thin = skeletonize(crop)
+    elif backend == "opencv":
+        # ximgproc never thins the pixels on the image border, the outer walls touch the crop's border
+        padded = cv2.copyMakeBorder(crop.view(np.uint8) * MAZE_COLOR, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        thin = cv2.ximgproc.thinning(padded, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN)[1:-1, 1:-1] != 0
+    elif backend == "lut":
+        thin = zhang_suen_thinning(crop)
+    else:
+        raise ValueError(f"unknown skeleton backend: {backend}")
+    skeleton[y:y + height, x:x + width][thin] = MAZE_COLOR
+    return skeleton
+
+
+def nearest_maze_point_index(image):
     """
-    image = np.copy(image)
-    image[image != 0] = 1
-    image = skeletonize(image).astype(int)
-    image[image != 0] = MAZE_COLOR
-    return image
+    builds an index of the closest maze point (in manhattan distance) to every cord
+    :param image: maze image
+    :return: numpy array (label of the closest maze point of every cord), numpy array (row, col of every label)
+             or None, None if the image has no maze points
+    """
+    off_maze = (image != MAZE_COLOR).astype(np.uint8)
+    if off_maze.all():
+        return None, None
+    # every maze point gets its own label which is spread to the cords closest to it
+    _, labels = cv2.distanceTransformWithLabels(off_maze, cv2.DIST_L1, 3, labelType=cv2.DIST_LABEL_PIXEL)
+    rows, cols = np.nonzero(off_maze == 0)
+    points = np.zeros((labels.max() + 1, 2), dtype=np.int32)
+    points[labels[rows, cols]] = np.stack([rows, cols], axis=1)
+    return labels, points
+
+
+def get_cache_settings():
+    """
+    gets the settings a cached maze must have been processed with to be reused
+    :return: dict (json serializable)
+    """
+    return {"threshold_mode": Config.threshold_mode,
+            "threshold_downsample": Config.threshold_downsample,
+            "skeleton_backend": Config.skeleton_backend,
+            "maze_size": [Config.maze_width, Config.maze_height],
+            "action_costs": Config.action_costs}
 
 
-def load_image_post_aruco(im):
+class DebugImageWriter(object):
+    """
+    writes debug images of the pipeline on a background thread so the pipeline does not wait for the disk
+    """
+    def __init__(self, directory, max_pending=8):
+        """
+        :param directory: directory to write the images to
+        :param max_pending: images waiting to be written, more images are dropped
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.pending = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self._write_pending, daemon=True)
+        self.thread.start()
+
+    def write(self, name, image):
+        """
+        queues an image to be written, the image must not be changed after it is queued
+        :param name: file name of the image
+        :param image: numpy array
+        :return: None
+        """
+        try:
+            self.pending.put_nowait((name, image))
+        except queue.Full:
+            logging.debug(f"dropped debug image {name}")
+
+    def flush(self):
+        """
+        blocks until all the queued images are written
+        :return: None
+        """
+        self.pending.join()
+
+    def _write_pending(self):
+        while True:
+            name, image = self.pending.get()
+            try:
+                if image.dtype != np.uint8:
+                    image = np.clip(image, 0, 255).astype(np.uint8)
+                cv2.imwrite(os.path.join(self.directory, name), image)
+            except Exception:
+                logging.exception(f"could not write debug image {name}")
+            finally:
+                self.pending.task_done()
+
+
+class MazePipeline(object):
+    """
+    image processing stage after extracting aruco information: threshold, warp and skeletonize.
+    """
+    def __init__(self, debug_writer=None):
+        """
+        :param debug_writer: DebugImageWriter to dump the intermediate images to, None to not dump them
+        """
+        self.debug_writer = debug_writer
+
+    def dump(self, name, image):
+        if self.debug_writer is not None:
+            self.debug_writer.write(name, image)
+
+    def run(self, im, timings=None, progress=None, warp_original=None):
+        """
+        warps image and returns transformation matrix
+        :param im: image to process
+        :param timings: dict to fill with the seconds each stage took
+        :param progress: function (part done, stage name) called before every stage
+        :param warp_original: warp the image without thresholding too, None to only warp it when it is dumped
+        :return: numpy array (warped), numpy array (warped without thresholding, None if it was not warped),
+                 numpy array (transformation matrix)
+        """
+        timings = {} if timings is None else timings
+        progress = progress or (lambda part, stage: None)
+        progress(0.0, "threshold")
+        start = time.perf_counter()
+        thresh, mask = threshold_image(im)
+        timings["threshold"] = time.perf_counter() - start
+        self.dump("thresh.jpg", thresh)
+        self.dump("mask.jpg", mask)
+        progress(0.4, "warp")
+        start = time.perf_counter()
+        warped, m = warp_image(thresh, mask)
+        timings["warp"] = time.perf_counter() - start
+        progress(0.6, "skeletonize")
+        start = time.perf_counter()
+        warped = skeletonize_image(warped)
+        timings["skeletonize"] = time.perf_counter() - start
+        warped_original = None
+        if warp_original or (warp_original is None and self.debug_writer is not None):
+            start = time.perf_counter()
+            warped_original = warp_image_saved_matrix(im, m)
+            timings["warp_original"] = time.perf_counter() - start
+            self.dump("warped-convex.jpg", warped_original)
+        for stage in ("threshold", "warp", "skeletonize", "warp_original"):
+            if stage in timings:
+                metrics.record(f"pipeline.{stage}", timings[stage])
+        return warped, warped_original, m
+
+
+def load_image_post_aruco(im, timings=None):
     """
     image processing stage after extracting aruco information.
     warps image and returns transformation matrix
     :param im: image to process
+    :param timings: dict to fill with the seconds each stage took
     :return: numpy array (warped), numpy array (warped without thresholding), numpy array (transformation matrix)
     """
-    print("1.1")
-    thresh, mask = threshold_image(im)
-    cv2.imwrite("thresh.jpg", thresh)
-    cv2.imwrite("mask.jpg", mask)
-    print("1.2")
-    warped, m = warp_image(thresh, mask)
-    print("1.3")
-    warped = skeletonize_image(warped).astype(np.uint8)
-    print("1.4")
-    warped_original = warp_image_saved_matrix(im, m)
-    cv2.imwrite("warped-convex.jpg", warped_original)
-    return warped, warped_original, m
+    return MazePipeline().run(im, timings, warp_original=True)
+
+
+def detect_markers(img, dictionary):
+    """
+    detects the aruCo in an image with the aruco api of the installed opencv.
+    the RPI's opencv has cv2.aruco.detectMarkers, opencv 4.7 and later only has ArucoDetector (PC)
+    :param img: grayscale image
+    :param dictionary: aruco dictionary
+    :return: marker corners, marker ids (None if no aruCo was found)
+    """
+    if hasattr(cv2.aruco, "detectMarkers"):
+        markerCorners, markerIds, rejectedCandidates = cv2.aruco.detectMarkers(img, dictionary)  # RPI
+    else:
+        detector = cv2.aruco.ArucoDetector(dictionary, cv2.aruco.DetectorParameters())  # PC
+        markerCorners, markerIds, rejectedCandidates = detector.detectMarkers(img)
+        if markerIds is not None:
+            # newer versions drop the single item axes the RPI's version returns
+            markerCorners = [np.reshape(corners, (1, 4, 2)) for corners in markerCorners]
+            markerIds = np.reshape(markerIds, (-1, 1))
+    return markerCorners, markerIds
 
 
 class ArucoData(object):
     def __init__(self, img, aruco_dict):
+        """
+        :param img: image to extract information from, None to start without information
+        :param aruco_dict: aruco dict to use for detection
+        """
         self.aruco_dict = aruco_dict
         self.aruco_info = {}
-        self.extract_basic_info(img)
+        # centers of the aruCo in the unwarped camera frame, filled by extract_frame_info
+        self.frame_centers = {}
+        if img is not None:
+            self.extract_basic_info(img)
 
     def extract_basic_info(self, img):
         """
@@ -209,27 +518,68 @@ class ArucoData(object):
         :param img: image to extract information from
         :return: None
         """
-        # TODO check if can use the commented lines
         dictionary = cv2.aruco.getPredefinedDictionary(self.aruco_dict)
-        # parameters = cv2.aruco.DetectorParameters()  # PC
-        # parameters.useAruco3Detection = True
-        # detector = cv2.aruco.ArucoDetector(dictionary, parameters)  # PC
-        markerCorners, markerIds, rejectedCandidates = cv2.aruco.detectMarkers(img, dictionary)  # RPI
-        # markerCorners, markerIds, rejectedCandidates = detector.detectMarkers(img) # PC
+        with metrics.span("aruco.detect") as span:
+            markerCorners, markerIds = detect_markers(img, dictionary)
+            span["markers"] = 0 if markerIds is None else len(markerIds)
         # Detect the ArUco markers in the image
         for index, id in enumerate(markerIds):
-            marker_corners = markerCorners[index][0]
-            center_x = int((marker_corners[0][0] + marker_corners[3][0]
-                            + marker_corners[1][0] + marker_corners[2][0]) / 4)
-            center_y = int((marker_corners[0][1] + marker_corners[3][1] +
-                            marker_corners[2][1] + marker_corners[1][1]) / 4)
-            p1, p2 = marker_corners[0], marker_corners[1]
-            angle = np.degrees(np.arctan2(p2[1] - p1[1], p2[0] - p1[0])) % 360
-            self.aruco_info[id[0]] = {"corners": marker_corners,
+            self.add_marker(id[0], markerCorners[index][0])
+        self.set_car_info()
+
+    def extract_frame_info(self, img, warp_matrix, roi=None):
+        """
+        extracts information about the aruCo in an unwarped camera frame.
+        only the corners of the aruCo are warped instead of the whole frame.
+        :param img: camera frame
+        :param warp_matrix: transformation matrix from the frame to the maze
+        :param roi: (x, y, width, height) part of the frame to search, None to search the whole frame
+        :return: None
+        """
+        x, y = 0, 0
+        if roi is not None:
+            x, y, width, height = roi
+            img = img[y:y + height, x:x + width]
+        dictionary = cv2.aruco.getPredefinedDictionary(self.aruco_dict)
+        with metrics.span("aruco.detect_frame" if roi is None else "aruco.detect_roi"):
+            markerCorners, markerIds = detect_markers(img, dictionary)
+        if markerIds is None:
+            return
+        frame_corners = np.float32(markerCorners).reshape(-1, 1, 2) + np.float32([x, y])
+        warped_corners = cv2.perspectiveTransform(frame_corners, warp_matrix).reshape(-1, 4, 2)
+        frame_corners = frame_corners.reshape(-1, 4, 2)
+        for index, id in enumerate(markerIds):
+            self.add_marker(id[0], warped_corners[index])
+            self.frame_centers[id[0]] = frame_corners[index].mean(axis=0)
+
+    def add_marker(self, marker_id, marker_corners):
+        """
+        adds the information of a single aruCo
+        :param marker_id: id of the aruCo
+        :param marker_corners: the 4 corners of the aruCo (x, y)
+        :return: None
+        """
+        center_x = int((marker_corners[0][0] + marker_corners[3][0]
+                        + marker_corners[1][0] + marker_corners[2][0]) / 4)
+        center_y = int((marker_corners[0][1] + marker_corners[3][1] +
+                        marker_corners[2][1] + marker_corners[1][1]) / 4)
+        p1, p2 = marker_corners[0], marker_corners[1]
+        angle = np.degrees(np.arctan2(p2[1] - p1[1], p2[0] - p1[0])) % 360
+        self.aruco_info[marker_id] = {"corners": marker_corners,
                                       "centerX": center_x,
                                       "centerY": center_y,
                                       "rotation": float(angle),
                                       }
+
+    def has_car(self):
+        # checks if both aruCo of the car were found
+        return Config.FORWARD_CAR_ID in self.aruco_info and Config.BACKWARD_CAR_ID in self.aruco_info
+
+    def set_car_info(self):
+        """
+        sets the car's information from its backward aruCo
+        :return: None
+        """
         self.aruco_info[Config.CAR_ID] = {"corners": [],
                                           "centerX": self.aruco_info[Config.BACKWARD_CAR_ID]['centerX'],
                                           "centerY": self.aruco_info[Config.BACKWARD_CAR_ID]['centerY'],
@@ -241,42 +591,230 @@ class MazeImage(object):
     """
     class that provides an interface to information regarding the maze
     """
-    def __init__(self, aruco_dict=cv2.aruco.DICT_4X4_50):
+    def __init__(self, aruco_dict=cv2.aruco.DICT_4X4_50, cache=None, pipeline=None):
         """
         :param aruco_dict: aruco dict to use for detection
+        :param cache: MazeCache to restore unchanged boards from, None to always process the initial image
+        :param pipeline: MazePipeline that processes the initial image
         """
         self.aruco_dict = aruco_dict
+        self.cache = cache
+        self.pipeline = pipeline if pipeline is not None else MazePipeline()
+        # path of the cache entry of the current maze
+        self.cache_entry = None
         self.data, warped_orig, self.warp_matrix = None, None, None
+        # (rows, cols) of the image the warp matrix was computed for and the matrix scaled to other frame shapes
+        self.initial_shape = None
+        self.frame_warp_matrices = {}
         self.original_image = None
         self.aruco = None
         self.warped_image = None
-
-    def load_initial_image(self, img):
+        self.maze_graph = None
+        # distance field to the end point and the end point it was computed for
+        self.distance_field = None
+        self.distance_field_end = None
+        # index of the closest maze point to every cord
+        self.nearest_labels, self.nearest_points = None, None
+        # capture time of the last camera frame and the car's center in the initial image's coordinates
+        self.pose_timestamp = None
+        self.car_frame_center = None
+        # seconds each stage of the last load_initial_image took
+        self.stage_timings = {}
+
+    def load_initial_image(self, img, progress=None):
         """
         loads initial image that contains only the maze
         :param img: image to process
+        :param progress: function (part done, stage name) called before every stage
         :return: None
         """
-        print("here")
-        self.data, warped_orig, self.warp_matrix = load_image_post_aruco(img)
-        self.original_image = np.copy(self.data)
+        self.stage_timings = {}
+        self.initial_shape = img.shape[:2]
+        self.frame_warp_matrices = {}
         self.aruco = None
-
-    def load_aruco_image(self, img):
+        self.maze_graph = None
+        self.distance_field = None
+        self.distance_field_end = None
+        self.pose_timestamp = None
+        self.car_frame_center = None
+        self.cache_entry = None
+        cached = None
+        board_corners = None
+        if self.cache is not None:
+            start = time.perf_counter()
+            # a moved board can have almost the same hash, its cached warp matrix would not fit it
+            board_corners = get_board_corners(img, Config.threshold_downsample)
+
+            def same_place(meta):
+                return "board_corners" in meta and \
+                    get_board_shift(board_corners, np.array(meta["board_corners"])) <= Config.maze_cache_max_shift
+
+            cached = self.cache.lookup(img, get_cache_settings(), same_place)
+            self.stage_timings["cache_lookup"] = time.perf_counter() - start
+        if cached is not None:
+            self.load_cached_maze(*cached)
+        else:
+            self.data, warped_orig, self.warp_matrix = self.pipeline.run(img, self.stage_timings, progress)
+            self.original_image = np.copy(self.data)
+            start = time.perf_counter()
+            self.nearest_labels, self.nearest_points = nearest_maze_point_index(self.original_image)
+            self.stage_timings["nearest_index"] = time.perf_counter() - start
+            if Config.build_maze_graph:
+                start = time.perf_counter()
+                self.maze_graph = build_maze_graph(self.original_image, Config.action_vectors, Config.action_costs,
+                                                   MAZE_COLOR)
+                self.stage_timings["maze_graph"] = time.perf_counter() - start
+            if self.cache is not None:
+                start = time.perf_counter()
+                self.cache_entry = self.cache.store(img, get_cache_settings(), self.get_cache_arrays(),
+                                                    {"board_corners": board_corners.tolist()})
+                self.stage_timings["cache_store"] = time.perf_counter() - start
+        logging.info("initial image stages: " +
+                     ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in self.stage_timings.items()))
+
+    def load_cached_maze(self, entry, arrays, meta):
+        """
+        restores a maze processed before from its cache entry, the arrays stay memory mapped
+        :param entry: path of the cache entry
+        :param arrays: dict of the arrays of the entry
+        :param meta: metadata of the entry
+        :return: None
+        """
+        self.cache_entry = entry
+        self.warp_matrix = np.array(arrays["warp_matrix"])
+        self.original_image = arrays["skeleton"]
+        self.data = np.copy(self.original_image)
+        if "nearest_labels" in arrays:
+            self.nearest_labels, self.nearest_points = arrays["nearest_labels"], arrays["nearest_points"]
+        if "graph_node_cells" in arrays:
+            self.maze_graph = MazeGraph.from_arrays(arrays)
+        elif Config.build_maze_graph:
+            self.get_maze_graph()
+        if "distance_field" in arrays:
+            self.distance_field = arrays["distance_field"]
+            self.distance_field_end = tuple(meta["distance_field_end"])
+
+    def get_cache_arrays(self):
+        """
+        gets the arrays of the current maze to cache
+        :return: dict mapping name to numpy array
+        """
+        arrays = {"warp_matrix": self.warp_matrix, "skeleton": self.original_image}
+        if self.nearest_labels is not None:
+            arrays["nearest_labels"] = self.nearest_labels
+            arrays["nearest_points"] = self.nearest_points
+        if self.maze_graph is not None:
+            arrays.update(self.maze_graph.to_arrays())
+        return arrays
+
+    def load_aruco_image(self, img, timestamp=None):
         """
         loads image with aruCo, warps and extracts aruCo information
         :param img:
+        :param timestamp: capture time of the image
         :return: None
         """
-        data = warp_image_saved_matrix(img, self.warp_matrix)
-        self.warped_image = np.copy(data)
+        data = warp_image_saved_matrix(img, self.get_frame_warp_matrix(img.shape))
+        self.warped_image = data
         self.aruco = ArucoData(data, self.aruco_dict)
         self.data = np.copy(self.original_image)
         # fills out the end aruCo to compensate for the need for accurate placing
         fill_aruco(self.data, self.aruco.aruco_info[Config.END_ID]['corners'])
+        if Config.distance_field:
+            self.get_distance_field()
+        self.pose_timestamp = timestamp
+        # the car's center in the initial image, where update_pose starts searching
+        self.car_frame_center = None
+        if self.aruco.has_car():
+            backward = self.aruco.aruco_info[Config.BACKWARD_CAR_ID]
+            forward = self.aruco.aruco_info[Config.FORWARD_CAR_ID]
+            center = np.float32([[[(backward['centerX'] + forward['centerX']) / 2,
+                                   (backward['centerY'] + forward['centerY']) / 2]]])
+            self.car_frame_center = cv2.perspectiveTransform(center, np.linalg.inv(self.warp_matrix))[0][0]
+
+    def update_pose(self, img, timestamp=None):
+        """
+        updates the location of the car from a camera frame.
+        searches for the car's aruCo around its last location in the frame and warps only their corners,
+        the end aruCo and the maze are kept from the last load_aruco_image.
+        a frame with the timestamp of the last processed frame is skipped.
+        :param img: camera frame
+        :param timestamp: capture time of the frame
+        :return: None
+        """
+        if timestamp is not None and timestamp == self.pose_timestamp:
+            return
+        if self.aruco is None:
+            self.load_aruco_image(img, timestamp)
+            return
+        warp_matrix = self.get_frame_warp_matrix(img.shape)
+        car = ArucoData(None, self.aruco_dict)
+        if self.car_frame_center is not None:
+            car.extract_frame_info(img, warp_matrix, self.get_pose_roi(img.shape))
+        if not car.has_car():
+            # lost the car around its last location, search the whole frame
+            car = ArucoData(None, self.aruco_dict)
+            car.extract_frame_info(img, warp_matrix)
+        # raises KeyError if the car is not in the frame, same as load_aruco_image
+        car.set_car_info()
+        for marker_id in (Config.FORWARD_CAR_ID, Config.BACKWARD_CAR_ID, Config.CAR_ID):
+            self.aruco.aruco_info[marker_id] = car.aruco_info[marker_id]
+        self.car_frame_center = (car.frame_centers[Config.FORWARD_CAR_ID] +
+                                 car.frame_centers[Config.BACKWARD_CAR_ID]) / 2 * self.get_frame_scale(img.shape)
+        self.pose_timestamp = timestamp
+
+    def get_pose_roi(self, shape):
+        """
+        gets the part of the camera frame around the car's last location
+        :param shape: shape of the camera frame
+        :return: (x, y, width, height)
+        """
+        scale_x, scale_y = self.get_frame_scale(shape)
+        center_x, center_y = self.car_frame_center[0] / scale_x, self.car_frame_center[1] / scale_y
+        size_x, size_y = int(Config.pose_roi_size / scale_x), int(Config.pose_roi_size / scale_y)
+        x = min(max(int(center_x) - size_x, 0), shape[1])
+        y = min(max(int(center_y) - size_y, 0), shape[0])
+        width = min(int(center_x) + size_x, shape[1]) - x
+        height = min(int(center_y) + size_y, shape[0]) - y
+        return x, y, max(width, 0), max(height, 0)
+
+    def get_frame_scale(self, shape):
+        """
+        gets the scale from a camera frame to the initial image the warp matrix was computed for
+        :param shape: shape of the camera frame
+        :return: numpy array (x scale, y scale)
+        """
+        if self.initial_shape is None:
+            return np.float32([1, 1])
+        return np.float32([self.initial_shape[1] / shape[1], self.initial_shape[0] / shape[0]])
 
-    def get_warped_image(self):
-        return self.warped_image
+    def get_frame_warp_matrix(self, shape):
+        """
+        gets the transformation matrix from a camera frame to the maze.
+        frames at another resolution than the initial image (such as downscaled tracking frames)
+        are scaled up to it before the warp.
+        :param shape: shape of the camera frame
+        :return: 3x3 transformation matrix
+        """
+        shape = tuple(shape[:2])
+        if self.initial_shape is None or shape == self.initial_shape:
+            return self.warp_matrix
+        if shape not in self.frame_warp_matrices:
+            scale_x, scale_y = self.get_frame_scale(shape)
+            self.frame_warp_matrices[shape] = self.warp_matrix @ np.diag([scale_x, scale_y, 1.0])
+        return self.frame_warp_matrices[shape]
+
+    def get_warped_image(self, frame=None):
+        """
+        gets a camera frame warped to the maze. update_pose does not keep its frames (they are views into
+        the camera's ring buffer), a frame is only warped when the image is needed
+        :param frame: camera frame to warp (a copy, not a ring buffer view), None for the frame of the last
+                      load_aruco_image
+        :return: numpy array
+        """
+        if frame is None:
+            return self.warped_image
+        return warp_image_saved_matrix(frame, self.get_frame_warp_matrix(frame.shape))
 
     def get_car_angle(self):
         return self.aruco.aruco_info[Config.CAR_ID]['rotation']
@@ -285,6 +823,47 @@ class MazeImage(object):
         # checks if cord is on maze
         return self.data[row][col] == MAZE_COLOR
 
+    def get_maze_mask(self):
+        """
+        boolean mask of the cords that are on the maze
+        :return: numpy array
+        """
+        return self.data == MAZE_COLOR
+
+    def get_skeleton_mask(self):
+        """
+        boolean mask of the skeleton without the filled aruCo
+        :return: numpy array
+        """
+        return self.original_image == MAZE_COLOR
+
+    def get_maze_graph(self):
+        """
+        gets the junction graph of the skeleton, builds it if it was not built on load
+        :return: MazeGraph
+        """
+        if self.maze_graph is None:
+            self.maze_graph = build_maze_graph(self.original_image, Config.action_vectors, Config.action_costs,
+                                               MAZE_COLOR)
+            if self.cache_entry is not None:
+                self.cache.update(self.cache_entry, self.maze_graph.to_arrays())
+        return self.maze_graph
+
+    def get_distance_field(self):
+        """
+        gets the distance field to the end point, computes it if the end point moved
+        :return: numpy array (uint32)
+        """
+        end_point = self.get_end_point()
+        if self.distance_field is None or self.distance_field_end != end_point:
+            self.distance_field = compute_distance_field(self.get_maze_mask(), end_point,
+                                                         Config.action_vectors, Config.action_costs)
+            self.distance_field_end = end_point
+            if self.cache_entry is not None:
+                self.cache.update(self.cache_entry, {"distance_field": self.distance_field},
+                                  {"distance_field_end": [int(value) for value in end_point]})
+        return self.distance_field
+
     def get_max_row(self):
         return self.data.shape[0]
 
@@ -304,30 +883,17 @@ class MazeImage(object):
 
     def get_start_point(self):
         """
-        runs BFS from the car's center to find closest point on maze to start movement from
-        :return: None
+        finds the closest point on maze to the car's center to start movement from
+        :return: (row, col)
         """
-
         curr_row, curr_col = self.get_current_point()
-        checked = []
-        q = [(curr_row, curr_col)]
-        while q:
-            v = q.pop(0)
-            if v not in checked:
-                checked.append(v)
-                if 0 <= v[0] < self.original_image.shape[0] \
-                        and 0 <= v[1] < self.original_image.shape[1] \
-                        and self.original_image[v[0]][v[1]] == MAZE_COLOR:
-                    return v
-                if (v[0], v[1] - 1) not in checked:
-                    q.append((v[0], v[1] - 1))
-                if (v[0] + 1, v[1]) not in checked:
-                    q.append((v[0] + 1, v[1]))
-                if (v[0], v[1] + 1) not in checked:
-                    q.append((v[0], v[1] + 1))
-                if (v[0] - 1, v[1]) not in checked:
-                    q.append((v[0] - 1, v[1]))
-        return self.get_current_point()
+        if self.nearest_labels is None:
+            return self.get_current_point()
+        # cords off the image snap to the closest point of the image's border first
+        row = min(max(curr_row, 0), self.original_image.shape[0] - 1)
+        col = min(max(curr_col, 0), self.original_image.shape[1] - 1)
+        nearest_row, nearest_col = self.nearest_points[self.nearest_labels[row, col]]
+        return int(nearest_row), int(nearest_col)
 
     def get_current_point(self):
         """
@@ -353,17 +919,3 @@ class MazeImage(object):
         backward = self.aruco.aruco_info[Config.BACKWARD_CAR_ID]
 
         return forward['centerY'] - backward['centerY'], forward['centerX'] - backward['centerX']
-
-#
-print("1.1")
-im = cv2.imread("orig.jpg", cv2.IMREAD_GRAYSCALE)
-thresh, mask = threshold_image(im)
-cv2.imwrite("thresh.jpg", thresh)
-cv2.imwrite("mask.jpg", mask)
-print("1.2")
-warped, m = warp_image(thresh, mask)
-print("1.3")
-warped = skeletonize_image(warped).astype(np.uint8)
-print("1.4")
-warped_original = warp_image_saved_matrix(im, m)
-cv2.imwrite("warped-convex.jpg", warped_original)
\ No newline at end of file
@@ -1,8 +1,27 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from config import Config
 from ImageProcessing.search_env import MazeSearchEnv
+from ImageProcessing.distance_field import UNREACHABLE, follow_distance_field
+from ImageProcessing.path_simplify import get_corridor, segment_in_corridor
+import cv2
 import heapdict
+import heapq
+import math
+import numpy as np
+
+
+def get_moves_by_mask(env, n_cols):
+    """
+    groups the moves of the environment by the values of its move table (see MazeSearchEnv.get_move_table)
+    :param env: the maze search environment
+    :param n_cols: number of columns of the maze image
+    :return: list indexed by move table value of lists of (action index, row delta, col delta, flat delta, cost)
+    """
+    moves = [(index, vector[0], vector[1], vector[0] * n_cols + vector[1], env.costs[name], env.action_bits[name])
+             for index, (name, vector) in enumerate(env.actions.items())]
+    return [[move[:5] for move in moves if mask & move[5]] for mask in range(1 << len(moves))]
 
 
 class SearchNode(object):
@@ -29,27 +48,50 @@ class Heuristic1(object):
         self.val = 0
 
     def get_h(self, env, state):
-        final_state = env.get_final_state()
-        end_row, end_col = final_state.get_value()
         cur_row, cur_col = state.get_value()
+        return self.get_h_cell(env, cur_row, cur_col)
+
+    def get_h_cell(self, env, cur_row, cur_col):
+        end_row, end_col = env.get_final_state().get_value()
         return abs(end_row - cur_row) + abs(end_col - cur_col)
 
 
 class ContextHeuristic(object):
     def __init__(self, past_actions):
         self.val = 1000
-        self.past_actions = past_actions
+        # set for constant time lookups, the path can hold thousands of cords
+        self.past_actions = set(past_actions)
 
     def get_h(self, env, state):
-        final_state = env.get_final_state()
-        end_row, end_col = final_state.get_value()
         cur_row, cur_col = state.get_value()
+        return self.get_h_cell(env, cur_row, cur_col)
+
+    def get_h_cell(self, env, cur_row, cur_col):
+        end_row, end_col = env.get_final_state().get_value()
         if (cur_row, cur_col) in self.past_actions:
             return 1
         else:
             return abs(end_row - cur_row) + abs(end_col - cur_col) + self.val
 
 
+class DistanceFieldHeuristic(object):
+    """
+    exact cost to the end read from the distance field of the environment
+    """
+    def __init__(self):
+        self.val = 0
+
+    def get_h(self, env, state):
+        cur_row, cur_col = state.get_value()
+        return self.get_h_cell(env, cur_row, cur_col)
+
+    def get_h_cell(self, env, cur_row, cur_col):
+        dist = env.get_distance_field()[cur_row, cur_col]
+        if dist == UNREACHABLE:
+            return np.inf
+        return int(dist)
+
+
 # In[4]:
 
 
@@ -120,18 +162,609 @@ class WeightedAStarAgent(object):
                                                            next_state,
                                                            next_node)
                         closed_nodes.pop(next_state.get_id())
-        print(self.expanded)
         return self.FAILURE  # what to do if cant find?
 
     def __get_f_value(self, node, state):
         return self.heuristic.get_h(self.env, state) * self.weight + node.cost * (1 - self.weight)
 
 
+class ArrayAStarAgent(object):
+    """
+    weighted A* with the same semantics as WeightedAStarAgent, working on flat cell indices
+    (row * cols + col) with numpy score/parent arrays and a heapq of (f, cell) tuples.
+    ties are broken by cell index which is the same (row, col) order MazeState uses.
+    """
+
+    def __init__(self, env, weight, heuristic):
+        self.env = env
+        self.FAILURE = (-1, -1, -1)
+        self.expanded = 0
+        self.weight = weight
+        self.heuristic = heuristic
+        self.start_state = env.get_initial_state()
+        self.action_names = list(env.actions.keys())
+
+    def set_start_state(self, start_state=None):
+        if start_state:
+            self.start_state = start_state
+
+    def run_search(self):
+        self.expanded = 0
+        move_table = self.env.get_move_table()
+        n_rows, n_cols = move_table.shape
+        move_table = move_table.ravel()
+        moves_by_mask = get_moves_by_mask(self.env, n_cols)
+
+        start_row, start_col = self.env.get_initial_state().get_value()
+        end_row, end_col = self.env.get_final_state().get_value()
+        start = start_row * n_cols + start_col
+        goal = end_row * n_cols + end_col
+
+        g_score = np.full(move_table.shape, np.inf)
+        f_score = np.full(move_table.shape, np.inf)
+        parent = np.full(move_table.shape, -1, dtype=np.int32)
+        parent_action = np.full(move_table.shape, -1, dtype=np.int8)
+
+        g_score[start] = 0
+        f_score[start] = self.__get_f_value(0, start_row, start_col)
+        open_nodes = [(f_score[start], start)]
+
+        while open_nodes:
+            current_f_val, current = heapq.heappop(open_nodes)
+            # a better path to this cell was pushed after this entry
+            if current_f_val > f_score[current]:
+                continue
+
+            if current == goal:
+                return self.__get_actions(parent, parent_action, start, goal), float(g_score[goal]), self.expanded
+
+            self.expanded += 1
+            cur_row, cur_col = divmod(current, n_cols)
+            cur_g = g_score[current]
+            for action_index, d_row, d_col, delta, cost in moves_by_mask[move_table[current]]:
+                next_cell = current + delta
+                next_g = cur_g + cost
+                next_f_val = self.__get_f_value(next_g, cur_row + d_row, cur_col + d_col)
+                # covers unseen cells, better paths to open cells and reopening closed cells
+                if next_f_val < f_score[next_cell]:
+                    f_score[next_cell] = next_f_val
+                    g_score[next_cell] = next_g
+                    parent[next_cell] = current
+                    parent_action[next_cell] = action_index
+                    heapq.heappush(open_nodes, (next_f_val, next_cell))
+        return self.FAILURE
+
+    def __get_actions(self, parent, parent_action, start, goal):
+        actions = []
+        cell = goal
+        while cell != start:
+            actions.append(self.action_names[parent_action[cell]])
+            cell = parent[cell]
+        actions.reverse()
+        return actions
+
+    def __get_f_value(self, cost, row, col):
+        return self.heuristic.get_h_cell(self.env, row, col) * self.weight + cost * (1 - self.weight)
+
+
+class GraphAStarAgent(object):
+    """
+    A* over the junction graph of the skeleton (see ImageProcessing.maze_graph).
+    the start and the end are joined to the graph by a pixel search that stops at graph nodes,
+    so only the corridors around them are searched pixel by pixel.
+    nodes next to the filled end aruCo do not stop the pixel search since the fill can connect
+    corridors the graph does not know about.
+    """
+
+    def __init__(self, env, weight, heuristic):
+        self.env = env
+        self.FAILURE = (-1, -1, -1)
+        self.expanded = 0
+        self.weight = weight
+        self.heuristic = heuristic
+        self.start_state = env.get_initial_state()
+        self.action_of_vector = {vector: name for name, vector in env.actions.items()}
+
+    def set_start_state(self, start_state=None):
+        if start_state:
+            self.start_state = start_state
+
+    def run_search(self):
+        self.expanded = 0
+        graph = self.env.get_maze_graph()
+        on_maze = self.env.get_maze_mask()
+        n_rows, n_cols = on_maze.shape
+        # nodes touching maze cords that are not on the skeleton (the filled aruCo)
+        filled = np.logical_and(on_maze, np.logical_not(self.env.get_skeleton_mask())).astype(np.uint8)
+        filled = cv2.dilate(filled, np.ones((3, 3), np.uint8)).ravel()
+        stop_nodes = {node for node, cell in enumerate(graph.node_cells) if not filled[cell]}
+        move_table = self.env.get_move_table().ravel()
+        moves_by_mask = get_moves_by_mask(self.env, n_cols)
+
+        start_row, start_col = self.env.get_initial_state().get_value()
+        end_row, end_col = self.env.get_final_state().get_value()
+        start = start_row * n_cols + start_col
+        goal = end_row * n_cols + end_col
+        if start == goal:
+            return [], 0, self.expanded
+
+        start_nodes, start_dist, start_parent = self.__local_search(start, move_table, moves_by_mask, graph,
+                                                                    stop_nodes)
+        goal_nodes, _, goal_parent = self.__local_search(goal, move_table, moves_by_mask, graph, stop_nodes)
+
+        # best cost found so far, and the node the path leaves the graph at
+        best_cost = start_dist.get(goal, np.inf)
+        best_node = None
+
+        g_score = {}
+        graph_parent = {}
+        open_nodes = []
+        for node, cost in start_nodes.items():
+            g_score[node] = cost
+            graph_parent[node] = (None, -1)
+            heapq.heappush(open_nodes, (cost + self.__get_h(graph, node, end_row, end_col), node))
+
+        while open_nodes:
+            current_f_val, node = heapq.heappop(open_nodes)
+            # manhattan distance never over estimates so nothing left can beat the best path
+            if current_f_val >= best_cost:
+                break
+            if current_f_val > g_score[node] + self.__get_h(graph, node, end_row, end_col):
+                continue
+            self.expanded += 1
+            if node in goal_nodes and g_score[node] + goal_nodes[node] < best_cost:
+                best_cost = g_score[node] + goal_nodes[node]
+                best_node = node
+            for next_node, cost, edge in graph.adjacency[node]:
+                next_g = g_score[node] + cost
+                if next_g < g_score.get(next_node, np.inf):
+                    g_score[next_node] = next_g
+                    graph_parent[next_node] = (node, edge)
+                    heapq.heappush(open_nodes,
+                                   (next_g + self.__get_h(graph, next_node, end_row, end_col), next_node))
+
+        if best_cost == np.inf:
+            return self.FAILURE
+
+        if best_node is None:
+            cells = self.__get_local_path(start_parent, goal)[::-1]
+        else:
+            edges = []
+            node = best_node
+            while graph_parent[node][0] is not None:
+                previous, edge = graph_parent[node]
+                edges.append((previous, edge))
+                node = previous
+            cells = self.__get_local_path(start_parent, graph.node_cells[node])[::-1]
+            for previous, edge in reversed(edges):
+                cells.extend(graph.get_edge_path(edge, previous)[1:])
+            cells.extend(self.__get_local_path(goal_parent, graph.node_cells[best_node])[1:])
+        return self.__cells_to_actions(cells, n_cols), best_cost, self.expanded
+
+    def __local_search(self, origin, move_table, moves_by_mask, graph, stop_nodes):
+        """
+        dijkstra over maze pixels from origin that does not expand past graph nodes
+        :return: dict node -> cost, dict cell -> cost, dict cell -> parent cell
+        """
+        reached_nodes = {}
+        dist = {origin: 0}
+        parent = {origin: None}
+        open_cells = [(0, origin)]
+        while open_cells:
+            cost, cell = heapq.heappop(open_cells)
+            if cost > dist[cell]:
+                continue
+            self.expanded += 1
+            node = graph.node_of_cell.get(cell)
+            if node is not None:
+                reached_nodes[node] = cost
+                if node in stop_nodes:
+                    continue
+            for _, _, _, delta, step_cost in moves_by_mask[move_table[cell]]:
+                next_cell = cell + delta
+                next_cost = cost + step_cost
+                if next_cost < dist.get(next_cell, np.inf):
+                    dist[next_cell] = next_cost
+                    parent[next_cell] = cell
+                    heapq.heappush(open_cells, (next_cost, next_cell))
+        return reached_nodes, dist, parent
+
+    @staticmethod
+    def __get_local_path(parent, cell):
+        # cells from cell back to the origin of the local search
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = parent[cell]
+        return path
+
+    @staticmethod
+    def __get_h(graph, node, end_row, end_col):
+        row, col = graph.get_node_point(node)
+        return abs(end_row - row) + abs(end_col - col)
+
+    def __cells_to_actions(self, cells, n_cols):
+        actions = []
+        for current, next_cell in zip(cells, cells[1:]):
+            cur_row, cur_col = divmod(current, n_cols)
+            next_row, next_col = divmod(next_cell, n_cols)
+            actions.append(self.action_of_vector[(next_row - cur_row, next_col - cur_col)])
+        return actions
+
+
+class DStarLiteAgent(object):
+    """
+    D* Lite over flat cell indices. the search runs backwards from the end so its state stays valid
+    when the car moves, and maze cords that changed since the last call (the filled end aruCo)
+    are repaired instead of searching from scratch. a new end point or a new maze restarts it.
+    D* Lite needs estimates towards the start, so the heuristic object is not used and
+    manhattan distance (which never over estimates the costs) is used instead.
+    """
+    # agent keeps its state between searches
+    incremental = True
+
+    def __init__(self, env, weight, heuristic):
+        self.env = env
+        self.FAILURE = (-1, -1, -1)
+        self.expanded = 0
+        self.weight = weight
+        self.heuristic = heuristic
+        self.start_state = env.get_initial_state()
+        self.action_names = list(env.actions.keys())
+        self.action_of_vector = {vector: name for name, vector in env.actions.items()}
+        self.on_maze = None
+        self.shape = None
+        self.goal = None
+
+    def set_start_state(self, start_state=None):
+        if start_state:
+            self.start_state = start_state
+
+    def run_search(self):
+        self.expanded = 0
+        on_maze = self.env.get_maze_mask()
+        n_rows, n_cols = on_maze.shape
+        on_maze = on_maze.ravel()
+        start_row, start_col = self.env.get_initial_state().get_value()
+        end_row, end_col = self.env.get_final_state().get_value()
+        start = start_row * n_cols + start_col
+        goal = end_row * n_cols + end_col
+        self.move_table = self.env.get_move_table().ravel()
+        self.moves_by_mask = get_moves_by_mask(self.env, n_cols)
+
+        if self.on_maze is None or self.shape != (n_rows, n_cols) or goal != self.goal:
+            self.__initialize(on_maze, (n_rows, n_cols), start, goal)
+        else:
+            changed = np.flatnonzero(self.on_maze != on_maze)
+            if len(changed) > Config.incremental_max_changed_cells:
+                self.__initialize(on_maze, (n_rows, n_cols), start, goal)
+            else:
+                # the keys already in the queue are lower bounds for the new start
+                self.km += self.__get_h(self.last_start, start)
+                self.last_start = start
+                self.on_maze = on_maze
+                for cell in changed.tolist():
+                    self.__update_vertex(cell)
+                    for next_cell, _ in self.__get_neighbours(cell, False):
+                        self.__update_vertex(next_cell)
+
+        self.__compute_shortest_path(start)
+        actions = self.__get_actions(start, goal) if self.g_score[start] != np.inf else None
+        if actions is None:
+            return self.FAILURE
+        return actions, float(self.g_score[start]), self.expanded
+
+    def __initialize(self, on_maze, shape, start, goal):
+        self.on_maze = on_maze
+        self.shape = shape
+        self.goal = goal
+        self.last_start = start
+        self.km = 0
+        self.g_score = np.full(on_maze.shape, np.inf)
+        self.rhs = np.full(on_maze.shape, np.inf)
+        # open_keys[cell] = key of the cell in the queue, entries with another key are stale
+        self.open_keys = {}
+        self.open_nodes = []
+        self.rhs[goal] = 0
+        self.__push(goal, self.__calculate_key(goal))
+
+    def __get_h(self, cell, other):
+        row, col = divmod(cell, self.shape[1])
+        other_row, other_col = divmod(other, self.shape[1])
+        return abs(row - other_row) + abs(col - other_col)
+
+    def __calculate_key(self, cell):
+        best = min(self.g_score[cell], self.rhs[cell])
+        return best + self.__get_h(self.last_start, cell) + self.km, best
+
+    def __push(self, cell, key):
+        self.open_keys[cell] = key
+        heapq.heappush(self.open_nodes, (key[0], key[1], cell))
+
+    def __top(self):
+        # drops stale entries, returns the entry with the smallest key or None
+        while self.open_nodes:
+            key_1, key_2, cell = self.open_nodes[0]
+            if self.open_keys.get(cell) == (key_1, key_2):
+                return self.open_nodes[0]
+            heapq.heappop(self.open_nodes)
+        return None
+
+    def __get_neighbours(self, cell, on_maze_only=True):
+        """
+        gets the neighbours of a cell
+        :param cell: flat cell
+        :param on_maze_only: only neighbours that can be moved between
+        :return: list of (cell, cost)
+        """
+        if on_maze_only:
+            if not self.on_maze[cell]:
+                return []
+            return [(cell + delta, cost) for _, _, _, delta, cost in self.moves_by_mask[self.move_table[cell]]]
+        n_rows, n_cols = self.shape
+        row, col = divmod(cell, n_cols)
+        neighbours = []
+        for name in self.action_names:
+            d_row, d_col = self.env.actions[name]
+            new_row = row + d_row
+            new_col = col + d_col
+            if new_row < 0 or new_row >= n_rows or new_col < 0 or new_col >= n_cols:
+                continue
+            neighbours.append((new_row * n_cols + new_col, self.env.costs[name]))
+        return neighbours
+
+    def __update_vertex(self, cell):
+        if cell != self.goal:
+            self.rhs[cell] = min([cost + self.g_score[next_cell]
+                                  for next_cell, cost in self.__get_neighbours(cell)], default=np.inf)
+        self.open_keys.pop(cell, None)
+        if self.g_score[cell] != self.rhs[cell]:
+            self.__push(cell, self.__calculate_key(cell))
+
+    def __compute_shortest_path(self, start):
+        while True:
+            top = self.__top()
+            if top is None:
+                return
+            if (top[0], top[1]) >= self.__calculate_key(start) and self.rhs[start] == self.g_score[start]:
+                return
+            heapq.heappop(self.open_nodes)
+            old_key, cell = (top[0], top[1]), top[2]
+            del self.open_keys[cell]
+            self.expanded += 1
+            new_key = self.__calculate_key(cell)
+            if old_key < new_key:
+                self.__push(cell, new_key)
+            elif self.g_score[cell] > self.rhs[cell]:
+                self.g_score[cell] = self.rhs[cell]
+                for next_cell, _ in self.__get_neighbours(cell):
+                    self.__update_vertex(next_cell)
+            else:
+                self.g_score[cell] = np.inf
+                self.__update_vertex(cell)
+                for next_cell, _ in self.__get_neighbours(cell):
+                    self.__update_vertex(next_cell)
+
+    def __get_actions(self, start, goal):
+        # follows the cheapest neighbours from the start down to the end, None if there is no way down
+        actions = []
+        cell = start
+        n_cols = self.shape[1]
+        while cell != goal and len(actions) < len(self.on_maze):
+            row, col = divmod(cell, n_cols)
+            best_cost, best_cell = np.inf, None
+            for next_cell, cost in self.__get_neighbours(cell):
+                if cost + self.g_score[next_cell] < best_cost:
+                    best_cost, best_cell = cost + self.g_score[next_cell], next_cell
+            if best_cell is None:
+                return None
+            next_row, next_col = divmod(best_cell, n_cols)
+            actions.append(self.action_of_vector[(next_row - row, next_col - col)])
+            cell = best_cell
+        return actions
+
+
+class DistanceFieldAgent(object):
+    """
+    reads the path from the distance field to the end point (see ImageProcessing.distance_field).
+    the field is computed once per end point, after that every start costs a walk down its gradient.
+    """
+
+    def __init__(self, env, weight, heuristic):
+        self.env = env
+        self.FAILURE = (-1, -1, -1)
+        self.expanded = 0
+        self.weight = weight
+        self.heuristic = heuristic
+        self.start_state = env.get_initial_state()
+
+    def set_start_state(self, start_state=None):
+        if start_state:
+            self.start_state = start_state
+
+    def run_search(self):
+        field = self.env.get_distance_field()
+        start = self.env.get_initial_state().get_value()
+        actions = follow_distance_field(field, start, self.env.actions, self.env.costs)
+        if actions is None:
+            self.expanded = 0
+            return self.FAILURE
+        self.expanded = len(actions)
+        return actions, int(field[start]), self.expanded
+
+
+class ThetaStarAgent(object):
+    """
+    any-angle A* (lazy theta*) over the maze cords. a cell's parent can be any cell it has line of sight to
+    inside a corridor around the maze lines, so the path is made of straight segments in any direction
+    instead of axis and diagonal moves. costs are euclidean lengths and the heuristic is the straight line
+    distance to the end point. the ends of the segments are kept in self.waypoints.
+    the line of sight is checked once per expanded cell, when it is taken out of the open list.
+    """
+
+    def __init__(self, env, weight, heuristic):
+        self.env = env
+        self.FAILURE = (-1, -1, -1)
+        self.expanded = 0
+        self.weight = weight
+        self.heuristic = heuristic
+        self.start_state = env.get_initial_state()
+        # (row, col) of the segment ends of the last path found, starting with the start point
+        self.waypoints = None
+        self.action_of_vector = {vector: name for name, vector in env.actions.items()}
+
+    def set_start_state(self, start_state=None):
+        if start_state:
+            self.start_state = start_state
+
+    def run_search(self):
+        self.expanded = 0
+        self.waypoints = None
+        move_table = self.env.get_move_table()
+        n_rows, n_cols = move_table.shape
+        move_table = move_table.ravel()
+        moves_by_mask = get_moves_by_mask(self.env, n_cols)
+        # the car may leave the skeleton by half the drawn line and the margin
+        corridor = get_corridor(self.env.get_maze_mask(), Config.line_width // 2 + Config.any_angle_margin)
+
+        start_row, start_col = self.env.get_initial_state().get_value()
+        end_row, end_col = self.env.get_final_state().get_value()
+        start = start_row * n_cols + start_col
+        goal = end_row * n_cols + end_col
+
+        g_score = np.full(move_table.shape, np.inf)
+        f_score = np.full(move_table.shape, np.inf)
+        parent = np.full(move_table.shape, -1, dtype=np.int64)
+        closed = np.zeros(move_table.shape, dtype=bool)
+
+        g_score[start] = 0
+        parent[start] = start
+        f_score[start] = self.__get_f_value(0, start_row, start_col, end_row, end_col)
+        open_nodes = [(f_score[start], start)]
+
+        while open_nodes:
+            current_f_val, current = heapq.heappop(open_nodes)
+            # a better path to this cell was pushed after this entry
+            if closed[current] or current_f_val > f_score[current]:
+                continue
+            cur_row, cur_col = divmod(current, n_cols)
+            if not self.__line_of_sight(corridor, parent[current], current, n_cols):
+                # the cell was reached assuming its parent sees it, fall back to the best expanded neighbour
+                best_g, best_parent = np.inf, -1
+                for _, d_row, d_col, delta, _ in moves_by_mask[move_table[current]]:
+                    neighbour = current + delta
+                    if closed[neighbour] and g_score[neighbour] + math.hypot(d_row, d_col) < best_g:
+                        best_g, best_parent = g_score[neighbour] + math.hypot(d_row, d_col), neighbour
+                if best_parent == -1:
+                    continue
+                g_score[current], parent[current] = best_g, best_parent
+            closed[current] = True
+
+            if current == goal:
+                self.waypoints = self.__get_waypoints(parent, start, goal, n_cols)
+                return self.__get_actions(self.waypoints), float(g_score[goal]), self.expanded
+
+            self.expanded += 1
+            cur_parent = parent[current]
+            parent_row, parent_col = divmod(cur_parent, n_cols)
+            for _, d_row, d_col, delta, _ in moves_by_mask[move_table[current]]:
+                next_cell = current + delta
+                if closed[next_cell]:
+                    continue
+                next_row, next_col = cur_row + d_row, cur_col + d_col
+                # assumes the parent sees the cell, checked when the cell is expanded
+                next_g = g_score[cur_parent] + math.hypot(next_row - parent_row, next_col - parent_col)
+                if next_g < g_score[next_cell]:
+                    g_score[next_cell] = next_g
+                    parent[next_cell] = cur_parent
+                    f_score[next_cell] = self.__get_f_value(next_g, next_row, next_col, end_row, end_col)
+                    heapq.heappush(open_nodes, (f_score[next_cell], next_cell))
+        return self.FAILURE
+
+    @staticmethod
+    def __line_of_sight(corridor, first, second, n_cols):
+        if first == second:
+            return True
+        return segment_in_corridor(corridor, divmod(first, n_cols), divmod(second, n_cols))
+
+    @staticmethod
+    def __get_waypoints(parent, start, goal, n_cols):
+        waypoints = [divmod(int(goal), n_cols)]
+        cell = goal
+        while cell != start:
+            cell = parent[cell]
+            waypoints.append(divmod(int(cell), n_cols))
+        waypoints.reverse()
+        return waypoints
+
+    def __get_actions(self, waypoints):
+        # the 8 connected steps along the segments, for the callers that work with actions
+        actions = []
+        for (row, col), (next_row, next_col) in zip(waypoints, waypoints[1:]):
+            steps = max(abs(next_row - row), abs(next_col - col))
+            rows = np.rint(np.linspace(row, next_row, steps + 1)).astype(int)
+            cols = np.rint(np.linspace(col, next_col, steps + 1)).astype(int)
+            actions.extend(self.action_of_vector[(int(d_row), int(d_col))]
+                           for d_row, d_col in zip(np.diff(rows), np.diff(cols)))
+        return actions
+
+    def __get_f_value(self, cost, row, col, end_row, end_col):
+        return math.hypot(end_row - row, end_col - col) * self.weight + cost * (1 - self.weight)
+
+
+# search agents that can be selected with Config.search_agent
+SEARCH_AGENTS = {
+    "weighted": WeightedAStarAgent,
+    "array": ArrayAStarAgent,
+    "graph": GraphAStarAgent,
+    "incremental": DStarLiteAgent,
+    "distance_field": DistanceFieldAgent,
+    "theta": ThetaStarAgent,
+}
+
+
+# heuristics of the agents that take a heuristic object ("weighted" and "array")
+HEURISTICS = {
+    "manhattan": Heuristic1,
+    "distance_field": DistanceFieldHeuristic,
+}
+
+
+def create_heuristic(name):
+    """
+    creates a heuristic by its name in HEURISTICS
+    :param name: name of the heuristic
+    :return: heuristic object
+    """
+    if name not in HEURISTICS:
+        raise ValueError(f"unknown search heuristic: {name}")
+    return HEURISTICS[name]()
+
+
+def create_agent(name, env, weight, heuristic):
+    """
+    creates a search agent by its name in SEARCH_AGENTS
+    :param name: name of the agent
+    :param env: the maze search environment
+    :param weight: weight of the heuristic in the f value
+    :param heuristic: heuristic object
+    :return: search agent
+    """
+    if name not in SEARCH_AGENTS:
+        raise ValueError(f"unknown search agent: {name}")
+    return SEARCH_AGENTS[name](env, weight, heuristic)
+
+
 if __name__ == "__main__":
-    maze_env = MazeSearchEnv("./practice_maze.png")
+    from ImageProcessing.preprocess_maze import MazeImage
+    # solves a saved camera frame of the board with the car and end aruCo on it
+    image = cv2.imread(Config.image_file, cv2.IMREAD_GRAYSCALE)
+    mi = MazeImage(Config.aruco_dict)
+    mi.load_initial_image(image)
+    mi.load_aruco_image(image)
+    maze_env = MazeSearchEnv(mi)
     a = WeightedAStarAgent(maze_env, 0, Heuristic1())
     actions, cost1, expanded = a.run_search()
     print(f"cost: {cost1}")
     print(f"expanded: {expanded}")
     maze_env.color_maze_path_and_print(actions)
-    maze_env.print_maze()
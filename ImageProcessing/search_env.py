@@ -2,7 +2,9 @@
 # coding: utf-8
 
 import cv2
+import numpy as np
 
+from config import Config
 from ImageProcessing.preprocess_maze import MazeImage
 
 """
@@ -50,27 +52,48 @@ class MazeSearchEnv(object):
     # get_start_point
     # get_data
     def __init__(self, mi):
-        self.actions = {"UP": (-1, 0), "DOWN": (1, 0), "LEFT": (0, -1), "RIGHT": (0, 1),
-                        "DIAG_UL": (-1, -1), "DIAG_UR": (-1, 1), "DIAG_DL": (1, -1), "DIAG_DR": (1, 1)}
-        self.costs = {"UP": 1, "DOWN": 1, "LEFT": 1, "RIGHT": 1,
-                        "DIAG_UL": 10, "DIAG_UR": 10, "DIAG_DL": 10, "DIAG_DR": 10}
+        self.actions = dict(Config.action_vectors)
+        self.costs = dict(Config.action_costs)
         self.__data_obj = mi
         self.data = self.__data_obj
         end_row, end_col = self.__data_obj.get_end_point()
         self.__final_state = MazeState(end_row, end_col)
         self.__cost = 1
+        # bit of every action in the move table
+        self.action_bits = {name: 1 << bit for bit, name in enumerate(self.actions)}
+        # legal action names for every possible move table value
+        self.__operators_by_mask = [[name for name, bit in self.action_bits.items() if mask & bit]
+                                    for mask in range(1 << len(self.actions))]
+        # move table and the maze data it was built from
+        self.__move_table = None
+        self.__move_table_data = None
 
     def get_image(self):
         return self.__data_obj.data
 
-    def get_warped_image(self):
-        return self.__data_obj.warped_image
+    def get_warped_image(self, frame=None):
+        return self.__data_obj.get_warped_image(frame)
+
+    def get_maze_mask(self):
+        return self.__data_obj.get_maze_mask()
+
+    def get_skeleton_mask(self):
+        return self.__data_obj.get_skeleton_mask()
+
+    def get_maze_graph(self):
+        return self.__data_obj.get_maze_graph()
+
+    def get_distance_field(self):
+        return self.__data_obj.get_distance_field()
 
     def get_car_angle(self):
         return self.__data_obj.get_car_angle()
 
-    def load_image(self, path):
-        self.__data_obj.load_aruco_image(path)
+    def load_image(self, path, timestamp=None):
+        self.__data_obj.load_aruco_image(path, timestamp)
+
+    def update_pose(self, img, timestamp=None):
+        self.__data_obj.update_pose(img, timestamp)
 
     def load_initial_image(self, img):
         self.__data_obj.load_initial_image(img)
@@ -113,9 +136,51 @@ class MazeSearchEnv(object):
 
         return True
 
+    def get_move_table(self):
+        """
+        gets a table with the legal moves out of every cord, built once per loaded maze image.
+        bit action_bits[action] of a cord is set if the action leads to a cord on the maze.
+        :return: numpy array (uint8) the size of the maze image
+        """
+        data = self.__data_obj.get_data()
+        if self.__move_table_data is not data:
+            on_maze = self.__data_obj.get_maze_mask()
+            rows, cols = on_maze.shape
+            # pad so moves out of the image land on cords that are not on the maze
+            padded = np.pad(on_maze, 1)
+            table = np.zeros(on_maze.shape, dtype=np.uint8)
+            for action_name, action in self.actions.items():
+                shifted = padded[1 + action[0]:1 + action[0] + rows, 1 + action[1]:1 + action[1] + cols]
+                table[shifted] |= self.action_bits[action_name]
+            self.__move_table = table
+            self.__move_table_data = data
+        return self.__move_table
+
+    def get_legal_operator_masks(self, rows, cols):
+        """
+        gets the legal moves of many cords at once
+        :param rows: numpy array of rows
+        :param cols: numpy array of cols
+        :return: numpy array of move table values (see get_move_table)
+        """
+        return self.get_move_table()[rows, cols]
+
+    def get_operators_of_mask(self, mask):
+        """
+        gets the names of the actions in a move table value
+        :param mask: move table value
+        :return: list of action names
+        """
+        return self.__operators_by_mask[mask]
+
+    def __in_table(self, row, col):
+        return 0 <= row < self.__data_obj.get_max_row() and 0 <= col < self.__data_obj.get_max_col()
+
     def get_legal_operators(self, state):
-        legal_actions = []
         curr_row, curr_col = state.get_value()
+        if self.__in_table(curr_row, curr_col):
+            return list(self.__operators_by_mask[self.get_move_table()[curr_row, curr_col]])
+        legal_actions = []
         for action_name, action in self.actions.items():
             new_row = curr_row + action[0]
             new_col = curr_col + action[1]
@@ -127,7 +192,11 @@ class MazeSearchEnv(object):
         curr_row, curr_col = state.get_value()
         new_row = curr_row + self.actions[action][0]
         new_col = curr_col + self.actions[action][1]
-        if not self.is_legal_state(new_row, new_col):
+        if self.__in_table(curr_row, curr_col):
+            legal = self.get_move_table()[curr_row, curr_col] & self.action_bits[action]
+        else:
+            legal = self.is_legal_state(new_row, new_col)
+        if not legal:
             raise RuntimeError("Illegal next state")
         return MazeState(new_row, new_col)
 
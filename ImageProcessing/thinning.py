@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Thinning methods
+
+zhang-suen thinning of a binary image with lookup tables.
+the 8 neighbours of every pixel are packed into a byte and each sub-iteration looks up
+which pixels to remove, so a whole pass is a handful of numpy operations.
+"""
+
+import numpy as np
+
+# (row delta, col delta) of the neighbours P2..P9, clockwise from the top.
+# neighbour k sets bit k of the neighbourhood code
+NEIGHBOURS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+
+def _build_tables():
+    """
+    builds the tables of the two sub-iterations
+    :return: numpy array (bool) per sub-iteration, indexed by neighbourhood code
+    """
+    first = np.zeros(256, dtype=bool)
+    second = np.zeros(256, dtype=bool)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = [(code >> bit) & 1 for bit in range(8)]
+        ring = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+        neighbours = sum(ring[:8])
+        transitions = sum(ring[i] == 0 and ring[i + 1] == 1 for i in range(8))
+        if not (2 <= neighbours <= 6 and transitions == 1):
+            continue
+        first[code] = p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+        second[code] = p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+    return first, second
+
+
+FIRST_PASS, SECOND_PASS = _build_tables()
+
+
+def zhang_suen_thinning(mask):
+    """
+    thins a binary image to a one pixel wide skeleton.
+    only the maze pixels are visited, through their flat indices in a padded image
+    :param mask: boolean image
+    :return: numpy array (bool) of the skeleton
+    """
+    rows, cols = mask.shape
+    padded = np.pad(np.asarray(mask, dtype=bool), 1).astype(np.uint8)
+    flat = padded.ravel()
+    offsets = [d_row * (cols + 2) + d_col for d_row, d_col in NEIGHBOURS]
+    cells = np.flatnonzero(flat)
+    changed = True
+    while changed:
+        changed = False
+        for table in (FIRST_PASS, SECOND_PASS):
+            codes = np.zeros(cells.shape, dtype=np.uint8)
+            for bit, offset in enumerate(offsets):
+                codes |= flat[cells + offset] << bit
+            remove = table[codes]
+            if remove.any():
+                flat[cells[remove]] = 0
+                cells = cells[~remove]
+                changed = True
+    return padded[1:-1, 1:-1].astype(bool)
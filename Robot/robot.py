@@ -63,7 +63,6 @@ class Robot(object):
         takes in PID value and gets the left and right wheel speeds to account for steer
         :return left speed, right speed
         """
-        print(f"max speed: {self.max_speed}")
         if steering > max_steering_angle:
             steering = max_steering_angle
         if steering < -max_steering_angle:
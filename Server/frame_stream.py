@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import cv2
+import numpy as np
+import websockets
+from config import Config
+
+"""
+Frame stream module
+
+pushes the status image to the subscribed app clients as binary JPEG websocket messages.
+every client picks its own rate and width, a frame is downscaled and encoded once per camera frame
+and width and the same bytes are sent to every client that asked for that width.
+"""
+
+# color of the planned path drawn on the streamed frames (BGR)
+PATH_COLOR = (0, 0, 255)
+
+
+class Subscriber(object):
+    def __init__(self, fps, width):
+        self.interval = 1 / fps
+        self.width = width
+        # event loop time the next frame is due
+        self.next_time = 0
+
+
+class FrameStreamer(object):
+    def __init__(self, maze):
+        """
+        :param maze: MazeManager to stream the status frames of
+        """
+        self.maze = maze
+        self.subscribers = {}
+        # key of the frame the encoded images are of and its encoded images by width
+        self.frame_key = None
+        self.encoded = {}
+        self.task = None
+
+    def subscribe(self, websocket, fps=None, width=None):
+        """
+        starts streaming to a client, must be called from the event loop
+        :param websocket: websocket of the client
+        :param fps: frames per second to send, capped by Config.stream_max_fps
+        :param width: width to downscale the frames to, capped by Config.stream_max_width
+        :return: None
+        """
+        fps = min(max(fps or Config.stream_default_fps, 0.1), Config.stream_max_fps)
+        width = min(max(int(width or Config.stream_default_width), 16), Config.stream_max_width)
+        self.subscribers[websocket] = Subscriber(fps, width)
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def unsubscribe(self, websocket):
+        self.subscribers.pop(websocket, None)
+
+    @staticmethod
+    def encode(image, width, path):
+        """
+        downscales a frame, draws the path on it and encodes it
+        :param image: grayscale frame
+        :param width: width to downscale to
+        :param path: list of (row, col) on the frame, None to not draw a path
+        :return: bytes (JPEG)
+        """
+        scale = min(width / image.shape[1], 1)
+        small = cv2.resize(image, (max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+        if path:
+            small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+            points = [[int(col * scale), int(row * scale)] for row, col in path]
+            cv2.polylines(small, [np.int32(points)], False, PATH_COLOR, 1)
+        success, binary_data = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, Config.stream_jpeg_quality])
+        return binary_data.tobytes()
+
+    def render(self, widths):
+        """
+        gets the status frame and encodes it at the widths that were not encoded yet. runs in the executor,
+        getting the status frame warps the camera frame
+        :param widths: widths the frame is needed at
+        :return: dict of width to bytes (JPEG), None if there is no frame
+        """
+        image, key, path = self.maze.get_status_frame()
+        if image is None:
+            return None
+        if key != self.frame_key:
+            self.frame_key = key
+            self.encoded = {}
+        for width in widths:
+            if width not in self.encoded:
+                self.encoded[width] = self.encode(image, width, path)
+        return self.encoded
+
+    async def send_frames(self, due):
+        # one render runs at a time, run() waits for it
+        encoded = await asyncio.get_running_loop().run_in_executor(
+            None, self.render, {subscriber.width for _, subscriber in due})
+        if encoded is None:
+            return
+        for websocket, subscriber in due:
+            try:
+                await websocket.send(encoded[subscriber.width])
+            except websockets.ConnectionClosed:
+                self.unsubscribe(websocket)
+
+    async def run(self):
+        # sends the due frames until no client is subscribed
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers:
+                now = loop.time()
+                due = [(websocket, subscriber) for websocket, subscriber in self.subscribers.items()
+                       if subscriber.next_time <= now]
+                for _, subscriber in due:
+                    subscriber.next_time = now + subscriber.interval
+                if due:
+                    await self.send_frames(due)
+                if self.subscribers:
+                    next_time = min(subscriber.next_time for subscriber in self.subscribers.values())
+                    await asyncio.sleep(max(next_time - loop.time(), 0))
+        except Exception as e:
+            logging.error(f"frame stream error: {repr(e)}")
+        finally:
+            self.task = None
@@ -0,0 +1,127 @@
+import threading
+import logging
+
+"""
+Jobs module
+
+runs the long control commands (loading the maze, solving it) on a background thread so the control
+server keeps answering while they run. the state and progress of the current job are kept in the
+status dict the app polls, and a job can be cancelled between its stages.
+"""
+
+# states of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """
+    raised by the progress callback of a job that was cancelled
+    """
+    pass
+
+
+class Job(object):
+    def __init__(self, name, status):
+        """
+        :param name: name of the job
+        :param status: status dict to report the job's state in (under "job")
+        """
+        self.name = name
+        self.status = status
+        self.state = QUEUED
+        self.progress = 0.0
+        self.stage = ""
+        self.cancel_requested = threading.Event()
+        self.publish()
+
+    def publish(self):
+        # the status dict is read by another thread, the entry is replaced as a whole
+        self.status["job"] = {"name": self.name, "state": self.state, "progress": self.progress, "stage": self.stage}
+
+    def report(self, progress, stage):
+        """
+        progress callback of the job, raises JobCancelled if the job was cancelled
+        :param progress: part of the job that is done (0 to 1)
+        :param stage: name of the stage the job is starting
+        :return: None
+        """
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+        self.progress = progress
+        self.stage = stage
+        self.publish()
+
+    def finish(self, state, stage=None):
+        self.state = state
+        if state == DONE:
+            self.progress = 1.0
+        if stage is not None:
+            self.stage = stage
+        self.publish()
+
+    def cancel(self):
+        # the job stops at its next stage
+        self.cancel_requested.set()
+
+    def is_active(self):
+        return self.state in (QUEUED, RUNNING)
+
+
+class JobRunner(object):
+    """
+    runs one job at a time on a background thread
+    """
+    def __init__(self, status):
+        """
+        :param status: status dict to report the jobs in
+        """
+        self.status = status
+        self.status.setdefault("job", None)
+        self.current = None
+        self.lock = threading.Lock()
+
+    def is_busy(self):
+        return self.current is not None and self.current.is_active()
+
+    def submit(self, name, function):
+        """
+        starts a job unless one is already running
+        :param name: name of the job
+        :param function: function of a progress callback (progress, stage) that runs the job
+        :return: Job, None if a job is already running
+        """
+        with self.lock:
+            if self.is_busy():
+                return None
+            job = Job(name, self.status)
+            self.current = job
+        t = threading.Thread(target=self.run_job, args=(job, function), daemon=True)
+        t.start()
+        return job
+
+    def run_job(self, job, function):
+        job.finish(RUNNING)
+        try:
+            function(job.report)
+            job.finish(DONE)
+        except JobCancelled:
+            logging.info(f"job {job.name} cancelled")
+            job.finish(CANCELLED)
+        except Exception as e:
+            logging.error(f"job {job.name} failed: {repr(e)}")
+            job.finish(FAILED, repr(e))
+
+    def cancel(self):
+        """
+        cancels the running job
+        :return: whether there was a job to cancel
+        """
+        job = self.current
+        if job is None or not job.is_active():
+            return False
+        job.cancel()
+        return True
@@ -0,0 +1,152 @@
+import struct
+from config import Config
+
+"""
+Protocol module
+
+binary codec of the messages between the RPI and the ESP32.
+every message is 16 bytes: opcode, source device, destination device, direction (1 byte each)
+followed by left speed, right speed and time (4 bytes each, little endian).
+
+a DIRECTION_BATCH message carries several direction steps at once: a header message whose direction
+field is the number of steps, followed by one 16 byte step per direction. a robot asks for a batch by
+putting the most steps it accepts in the direction field of its DIRECTION_REQUEST, robots that leave it
+0 get single DIRECTION_MSG replies.
+"""
+
+# opcode, src dev, dst dev, direction, left speed, right speed, time
+MESSAGE = struct.Struct("<4B3I")
+MESSAGE_SIZE = MESSAGE.size
+# direction, padding, left speed, right speed, time. same size as a message so batches keep the 16 byte framing
+STEP = struct.Struct("<B3x3I")
+OPCODES = frozenset(Config.opcodes.values())
+# largest number of steps in a batch
+MAX_BATCH_STEPS = 255
+
+
+def parse_message(buffer, offset=0):
+    """
+    parses a message without copying the buffer
+    :param buffer: bytes, bytearray or memoryview that holds the message
+    :param offset: offset of the message in the buffer
+    :return: dict with the fields of the message
+    """
+    opcode, src_dev, dst_dev, direction, left_speed, right_speed, time = MESSAGE.unpack_from(buffer, offset)
+    return {"opcode": opcode,
+            "src_dev": src_dev,
+            "dst_dev": dst_dev,
+            "direction": direction,
+            "time": time,
+            "left_speed": left_speed,
+            "right_speed": right_speed
+            }
+
+
+def create_message(opcode, src, dst, direction, l, r, time):
+    """
+    creates a message
+    :return: bytes
+    """
+    return MESSAGE.pack(opcode, src, dst, direction, l, r, time)
+
+
+def create_batch(src, dst, steps):
+    """
+    creates a DIRECTION_BATCH message
+    :param src: source device code
+    :param dst: destination device code
+    :param steps: list of (direction, left speed, right speed, time)
+    :return: bytes
+    """
+    steps = steps[:MAX_BATCH_STEPS]
+    buffer = bytearray(MESSAGE_SIZE + STEP.size * len(steps))
+    MESSAGE.pack_into(buffer, 0, Config.opcodes['DIRECTION_BATCH'], src, dst, len(steps), 0, 0, 0)
+    for index, step in enumerate(steps):
+        STEP.pack_into(buffer, MESSAGE_SIZE + STEP.size * index, *step)
+    return bytes(buffer)
+
+
+def parse_batch_steps(buffer, count, offset=0):
+    """
+    parses the steps that follow a DIRECTION_BATCH header
+    :param buffer: bytes, bytearray or memoryview that holds the steps
+    :param count: number of steps (the direction field of the header)
+    :param offset: offset of the first step in the buffer
+    :return: list of (direction, left speed, right speed, time)
+    """
+    return [STEP.unpack_from(buffer, offset + STEP.size * index) for index in range(count)]
+
+
+class MessageReader(object):
+    """
+    splits a byte stream into messages. reads may hold part of a message or several messages,
+    the remainder of a read is kept for the next one. received bytes go straight into a reusable buffer.
+    """
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # number of received bytes in the buffer
+        self.filled = 0
+
+    def recv_into(self, sock):
+        """
+        receives from a socket into the buffer
+        :param sock: connected socket
+        :return: number of bytes received, 0 if the connection was closed
+        """
+        received = sock.recv_into(self.get_buffer())
+        self.buffer_updated(received)
+        return received
+
+    def get_buffer(self):
+        """
+        gets the free part of the buffer to receive into, such as for asyncio.BufferedProtocol.get_buffer
+        :return: memoryview
+        """
+        return self.view[self.filled:]
+
+    def buffer_updated(self, received):
+        """
+        adds bytes that were received into get_buffer()
+        :param received: number of bytes received
+        :return: None
+        """
+        self.filled += received
+
+    def feed(self, data):
+        """
+        adds received bytes, for streams that do not support recv_into
+        :param data: bytes
+        :return: None
+        """
+        self.view[self.filled:self.filled + len(data)] = data
+        self.filled += len(data)
+
+    def free_space(self):
+        return len(self.buffer) - self.filled
+
+    def messages(self):
+        """
+        parses the complete messages in the buffer
+        :return: list of dicts with the fields of every message, a DIRECTION_BATCH message also
+                 has its list of steps under "steps". messages with unknown opcodes are skipped
+        """
+        messages = []
+        offset = 0
+        while self.filled - offset >= MESSAGE_SIZE:
+            message = parse_message(self.view, offset)
+            if message["opcode"] == Config.opcodes['DIRECTION_BATCH']:
+                size = MESSAGE_SIZE + STEP.size * message["direction"]
+                if self.filled - offset < size:
+                    break
+                message["steps"] = parse_batch_steps(self.view, message["direction"], offset + MESSAGE_SIZE)
+            else:
+                size = MESSAGE_SIZE
+            offset += size
+            if message["opcode"] in OPCODES:
+                messages.append(message)
+        # keep the part of a message that was not received yet at the start of the buffer
+        remaining = self.filled - offset
+        self.view[:remaining] = self.view[offset:self.filled]
+        self.filled = remaining
+        return messages
@@ -1,11 +1,17 @@
-import socket
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import asyncio
 import websockets
 import math
 import cv2
 from config import Config
+from Server import protocol
+from Server.jobs import JobRunner
+from Server.frame_stream import FrameStreamer
+from metrics import metrics
+from logging_setup import setup_logging, is_tracing, trace
 import base64
 import json
 
@@ -16,14 +22,33 @@ def dist(c1, c2):
 
 
 class DirectionsServer:
-    def __init__(self, ip, port, maze):
+    """
+    serves the direction requests of the robots. the solver work runs in an executor so the event loop
+    keeps reading requests while a frame is processed.
+    robots are keyed by their device code. with a context_factory every robot has its own solver context and
+    robots are served concurrently. without one (as main.py runs it, there is one camera and one car aruCo)
+    every robot shares the MazeManager and the requests are served one at a time.
+    """
+    def __init__(self, ip, port, maze, context_factory=None, workers=None):
+        """
+        :param ip: ip to serve on
+        :param port: port to serve on
+        :param maze: MazeManager, the solver context of every robot unless context_factory is given
+        :param context_factory: function of a device code that creates the solver context of a robot
+        :param workers: number of threads that run solver work
+        """
         self.stopped = True
         self.ip = ip
         self.port = port
         self.lock = threading.Lock()
         self.maze = maze
+        self.context_factory = context_factory
+        # solver context and request lock of every robot, by device code (robots that share a context share its lock)
+        self.contexts = {}
+        self.context_locks = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers or Config.directions_workers)
 
-        logging.basicConfig(filename=Config.logging_file, level=logging.DEBUG)
+        setup_logging()
         logging.info("started new server instance")
 
     def updating_started(self):
@@ -33,89 +58,182 @@ class DirectionsServer:
         self.lock.release()
 
     def parse_message(self, data):
-        opcode = data[0:1]
-        src_dev = data[1:2]
-        dst_dev = data[2:3]
-        direction = data[3:4]
-        l = data[4:8]
-        r = data[8:12]
-        time = data[12:16]
-
-        return {"opcode": int.from_bytes(opcode, byteorder="little"),
-                "src_dev": int.from_bytes(src_dev, byteorder="little"),
-                "dst_dev": int.from_bytes(dst_dev, byteorder="little"),
-                "direction": int.from_bytes(direction, byteorder="little"),
-                "time": int.from_bytes(time, byteorder="little"),
-                "left_speed": int.from_bytes(l, byteorder="little"),
-                "right_speed": int.from_bytes(r, byteorder="little")
-                }
+        return protocol.parse_message(data)
 
     def create_message(self, opcode, src, dst, dir, l, r, time):
-        msg = opcode.to_bytes(1, "little") + src.to_bytes(1, "little") + dst.to_bytes(1, "little") \
-              + dir.to_bytes(1, "little") \
-              + l.to_bytes(4, "little") + r.to_bytes(4, "little") + time.to_bytes(4, "little")
-        return msg
+        return protocol.create_message(opcode, src, dst, dir, l, r, time)
+
+    def get_context(self, dev_code):
+        """
+        gets the solver context of a robot, created on its first request
+        :param dev_code: device code of the robot
+        :return: context with the direction interface of MazeManager
+        """
+        if dev_code not in self.contexts:
+            context = self.context_factory(dev_code) if self.context_factory else self.maze
+            # robots with the same context share its lock, a context is only advanced by one request at a time
+            lock = next((self.context_locks[code] for code, other in self.contexts.items() if other is context), None)
+            self.contexts[dev_code] = context
+            self.context_locks[dev_code] = lock or asyncio.Lock()
+        return self.contexts[dev_code]
+
+    def get_next_directions(self, context, max_steps=1):
+        """
+        advances a robot's solver and gets its next directions. runs in the executor
+        :param context: solver context of the robot
+        :param max_steps: most directions the robot accepts at once
+        :return: list of (direction, left speed, right speed, time)
+        """
+        if getattr(context, "prefetching", False):
+            # the context keeps its next direction computed from the newest frame
+            return [context.get_prefetched_direction()]
+        if context.is_stopped():
+            logging.debug("server stopped")
+            return [(Config.stay, 0, 0, 0)]
+        # recalculate coefficient and confidence from last movement
+        with metrics.span("update_step"):
+            context.update_step()
+        if context.is_finished():
+            logging.debug("server stopped")
+            return [(Config.finished, 0, 0, 0)]
+        if self.lock.locked():
+            logging.debug("updating in progress")
+            return [(Config.stay, 0, 0, 0)]
+        # get next direction
+        if max_steps > 1 and hasattr(context, "get_planned_directions"):
+            return context.get_planned_directions(max_steps)
+        return [context.get_dynamic_next_direction()]
+
+    def serve_request(self, dev_code, context, max_steps):
+        """
+        gets the next directions of a robot and traces the control cycle. runs in the executor
+        :param dev_code: device code of the robot
+        :param context: solver context of the robot
+        :param max_steps: most directions the robot accepts at once
+        :return: list of (direction, left speed, right speed, time)
+        """
+        next_directions = self.get_next_directions(context, max_steps)
+        if is_tracing() and hasattr(context, "get_cycle_trace") and not getattr(context, "prefetching", False):
+            trace(dict(context.get_cycle_trace(next_directions[0]), dev=dev_code))
+        return next_directions
+
+    async def handle_robot(self, connection):
+        """
+        serves the direction requests of a single connection
+        :param connection: RobotConnection of the robot
+        :return: None
+        """
+        addr = connection.transport.get_extra_info("peername")
+        logging.debug(f"Connected by {addr}")
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                parsed_message = await connection.get_message()
+                if parsed_message is None:
+                    break
+                if parsed_message['opcode'] != Config.opcodes['DIRECTION_REQUEST']:
+                    continue
+
+                # the round trip of the request from its parsing until its reply is sent
+                start = time.perf_counter()
+                dev_code = parsed_message['src_dev']
+                context = self.get_context(dev_code)
+                # the direction field of a request is the most steps the robot accepts at once
+                max_steps = parsed_message['direction']
+                # a context's requests are served in order, robots with other contexts are served meanwhile
+                async with self.context_locks[dev_code]:
+                    next_directions = await loop.run_in_executor(self.executor, self.serve_request,
+                                                                 dev_code, context, max_steps)
+                if max_steps > 1:
+                    msg = protocol.create_batch(Config.dev_codes['RPI'], dev_code, next_directions)
+                else:
+                    next_direction = next_directions[0]
+                    msg = self.create_message(Config.opcodes['DIRECTION_MSG'],
+                                              Config.dev_codes['RPI'],
+                                              dev_code,
+                                              next_direction[0],
+                                              next_direction[1],
+                                              next_direction[2],
+                                              next_direction[3]
+                                              )
+                # send data to bot
+                connection.transport.write(msg)
+                metrics.record("direction_request", time.perf_counter() - start)
+            logging.debug(f"Disconnected {addr}")
+        except Exception as e:
+            logging.error(f"Server error with {addr}: {repr(e)}")
+        finally:
+            connection.transport.close()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: RobotConnection(self), self.ip, self.port)
+        logging.debug(f"Server Listening")
+        async with server:
+            await server.serve_forever()
 
     def start_server(self):
         if not self.maze.to_run():
             return
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(50000)
-            # start up server
-            try:
-                s.bind((self.ip, self.port))
-                print("bound")
-                s.listen()
-                print("listening")
-            except Exception as e:
-                logging.error(f"Server startup error: {repr(e)}")
+        try:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.serve())
+        except Exception as e:
+            logging.error(f"Server startup error: {repr(e)}")
 
-            while True:
-                try:
-                    logging.debug(f"Server Listening")
-
-                    print("waiting for connection")
-                    conn, addr = s.accept()
-                    print("connected")
-                    with conn:
-                        logging.debug(f"Connected by {addr}")
-                        while True:
-                            # receive data from bot
-                            data = conn.recv(1024)
-                            parsed_message = self.parse_message(data)
-
-                            if not data or parsed_message['opcode'] not in list(Config.opcodes.values()):
-                                continue
-
-                            if parsed_message['opcode'] == Config.opcodes['DIRECTION_REQUEST']:
-
-                                if self.maze.is_stopped():
-                                    logging.debug("server stopped")
-                                    next_direction = (Config.stay, 0, 0, 0)
-                                else:
-                                    # recalculate coefficient and confidence from last movement
-                                    self.maze.update_step()
-                                    if self.maze.is_finished():
-                                        logging.debug("server stopped")
-                                        next_direction = (Config.finished, 0, 0, 0)
-                                    elif self.lock.locked():
-                                        logging.debug("updating in progress")
-                                        next_direction = (Config.stay, 0, 0, 0)
-                                    else:  # get next direction
-                                        next_direction = self.maze.get_dynamic_next_direction()
-                                msg = self.create_message(Config.opcodes['DIRECTION_MSG'],
-                                                          Config.dev_codes['RPI'],
-                                                          Config.dev_codes['ESP_32'],
-                                                          next_direction[0],
-                                                          next_direction[1],
-                                                          next_direction[2],
-                                                          next_direction[3]
-                                                          )
-                                # send data to bot and log to console
-                                conn.sendall(msg)
-
-                except Exception as e:
-                    print(e)
+
+class RobotConnection(asyncio.BufferedProtocol):
+    """
+    connection of a robot to the DirectionsServer. the socket reads go straight into the buffer of a
+    protocol.MessageReader (reads may hold part of a message or several messages) and the parsed messages
+    are queued for DirectionsServer.handle_robot
+    """
+    def __init__(self, server, max_pending=64):
+        """
+        :param server: DirectionsServer that serves the connection
+        :param max_pending: number of queued messages above which reading pauses until they are served
+        """
+        self.server = server
+        self.max_pending = max_pending
+        self.message_reader = protocol.MessageReader()
+        self.pending = asyncio.Queue()
+        self.transport = None
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        asyncio.get_running_loop().create_task(self.server.handle_robot(self))
+
+    def get_buffer(self, sizehint):
+        return self.message_reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.message_reader.buffer_updated(nbytes)
+        for message in self.message_reader.messages():
+            self.pending.put_nowait(message)
+        if self.pending.qsize() > self.max_pending and not self.paused:
+            self.paused = True
+            self.transport.pause_reading()
+
+    def eof_received(self):
+        self.pending.put_nowait(None)
+        # closes the connection once handle_robot is done
+        return True
+
+    def connection_lost(self, exc):
+        self.pending.put_nowait(None)
+
+    async def get_message(self):
+        """
+        waits for the next message of the robot
+        :return: dict of the message fields, None once the connection is closed
+        """
+        message = await self.pending.get()
+        if self.paused and self.pending.qsize() <= self.max_pending // 2:
+            self.paused = False
+            self.transport.resume_reading()
+        return message
 
 
 class ControlServer:
@@ -124,15 +242,54 @@ class ControlServer:
         self.port = port
         self.maze = maze
         self.stop_counter = 0
-        logging.basicConfig(filename=Config.logging_file, level=logging.DEBUG)
+        # runs the long commands off the event loop, created once the maze's status exists
+        self.jobs = None
+        # pushes the status frames to the clients that subscribed to them
+        self.streamer = FrameStreamer(maze)
+        setup_logging()
         logging.info("started new websocket server instance")
         print("started new websocket server instance")
 
     def start_server(self):
         print("starting control server")
+        self.jobs = JobRunner(self.maze.get_status())
         self.run_server()
 
+    def submit_job(self, name, function):
+        """
+        runs a long command as a background job, the status command reports its progress
+        :param name: name of the command
+        :param function: function of a progress callback that runs the command
+        :return: None
+        """
+        if self.jobs.submit(name, function) is None:
+            logging.info(f"got command {name} while job {self.jobs.current.name} is running, ignoring it")
+
+    def encode_status_image(self):
+        success, binary_data = cv2.imencode('.jpg', self.maze.get_status_image())
+        return base64.b64encode(binary_data).decode('utf-8')
+
     async def handle_client(self, websocket, path):
+        try:
+            await self.handle_messages(websocket)
+        finally:
+            self.streamer.unsubscribe(websocket)
+
+    def subscribe_stream(self, websocket, message):
+        """
+        subscribes a client to the frame stream
+        :param websocket: websocket of the client
+        :param message: "stream", "stream <fps>" or "stream <fps> <width>"
+        :return: None
+        """
+        try:
+            fps, width = (list(map(float, message.split()[1:3])) + [None, None])[:2]
+        except ValueError:
+            logging.info(f"got bad stream command {message}, using the defaults")
+            fps, width = None, None
+        self.streamer.subscribe(websocket, fps, width)
+
+    async def handle_messages(self, websocket):
         async for message in websocket:
             if message == "start":
                 print("got command: start")
@@ -151,22 +308,39 @@ class ControlServer:
 
             if message == "reset":
                 print("got command: reset")
-                self.maze.restart_maze()
+                self.submit_job("reset", self.maze.restart_maze)
 
             if message == "pic":
                 print("got command: pic")
-                self.maze.load_env(from_file=False)
+                self.submit_job("pic", lambda progress: self.maze.load_env(from_file=False, progress=progress))
+
+            if message == "cancel":
+                print("got command: cancel")
+                self.jobs.cancel()
 
             if message == "status":
                 status = {"type": "status", "status": self.maze.get_status()}
                 await websocket.send(json.dumps(status))
 
+            if message == "metrics":
+                status = {"type": "metrics", "metrics": metrics.snapshot()}
+                await websocket.send(json.dumps(status))
+
             if message == "maze":
-                success, binary_data = cv2.imencode('.jpg', self.maze.get_status_image())
-                base64_data = base64.b64encode(binary_data).decode('utf-8')
+                # encoding the image would hold up the other clients
+                base64_data = await asyncio.get_running_loop().run_in_executor(None, self.encode_status_image)
                 status = {"type": "maze", "maze": base64_data}
                 await websocket.send(json.dumps(status))
 
+            # binary messages are not commands
+            if isinstance(message, str) and message.startswith("stream") and message != "stream_stop":
+                print(f"got command: {message}")
+                self.subscribe_stream(websocket, message)
+
+            if message == "stream_stop":
+                print("got command: stream_stop")
+                self.streamer.unsubscribe(websocket)
+
     async def start_webserver(self):
         async with websockets.serve(self.handle_client, self.ip, self.port):
             print("WebSocket server started")
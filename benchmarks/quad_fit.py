@@ -0,0 +1,86 @@
+"""
+Quadrilateral fit benchmark
+
+compares get_best_fit_quad against the brute force search it replaced on recorded board images
+(or on synthetic noisy boards when no images are given).
+run from the repository root:
+    python -m benchmarks.quad_fit board1.jpg board2.jpg
+    python -m benchmarks.quad_fit --synthetic 10
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+
+from ImageProcessing.preprocess_maze import threshold_image, get_best_fit_quad, get_best_fit_quad_brute_force, \
+    cyclic_intersection_pts
+
+
+def board_contour_from_image(path):
+    """
+    gets the board contour the same way warp_image does
+    :param path: path to a recorded board image
+    :return: contour
+    """
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    _, mask = threshold_image(img)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return max(contours, key=cv2.contourArea)
+
+
+def synthetic_board_contour(rng, noise=4, points=400):
+    """
+    a perspective distorted rectangle with a noisy edge
+    :return: contour
+    """
+    corners = np.float32([[400, 300], [2200, 250], [2300, 1700], [350, 1650]]) + rng.uniform(-100, 100, (4, 2))
+    edge = []
+    for start, end in zip(corners, np.roll(corners, -1, axis=0)):
+        t = np.linspace(0, 1, points // 4, endpoint=False)[:, None]
+        edge.append(start + t * (end - start))
+    edge = np.concatenate(edge) + rng.normal(0, noise, (points // 4 * 4, 2))
+    return edge.astype(np.int32).reshape(-1, 1, 2)
+
+
+def time_fit(fit, contour):
+    start = time.perf_counter()
+    corners = fit(contour)
+    return corners, time.perf_counter() - start
+
+
+def corner_error(corners, reference):
+    """
+    largest distance between matching corners
+    """
+    corners = cyclic_intersection_pts(np.asarray(corners, dtype=np.float64))
+    reference = cyclic_intersection_pts(np.asarray(reference, dtype=np.float64))
+    if corners is None or reference is None:
+        return float("nan")
+    return float(np.max(np.linalg.norm(corners - reference, axis=1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="recorded board images")
+    parser.add_argument("--synthetic", type=int, default=0, help="number of synthetic boards to add")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    contours = [(path, board_contour_from_image(path)) for path in args.images]
+    contours += [(f"synthetic-{i}", synthetic_board_contour(rng)) for i in range(args.synthetic)]
+    if not contours:
+        parser.error("no images or synthetic boards to benchmark")
+
+    print(f"{'board':<24}{'hull':>6}{'fast [s]':>12}{'brute [s]':>12}{'speedup':>10}{'corner err':>12}")
+    for name, contour in contours:
+        hull_size = len(cv2.convexHull(contour))
+        fast, fast_time = time_fit(get_best_fit_quad, contour)
+        brute, brute_time = time_fit(get_best_fit_quad_brute_force, contour)
+        print(f"{name:<24}{hull_size:>6}{fast_time:>12.4f}{brute_time:>12.4f}"
+              f"{brute_time / max(fast_time, 1e-9):>10.0f}{corner_error(fast, brute):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Replay benchmark
+
+runs the whole MazeManager pipeline on recorded frames, without the pi camera, the ESP32 or the app.
+the recording is fed through a camera over a replay frame source, the directions server is served on
+localhost and a simulated ESP32 asks it for directions like the robot does.
+writes the latency percentiles of every stage to a json report.
+run from the repository root:
+    python -m benchmarks.replay run.h264 --board board.jpg
+    python -m benchmarks.replay "frames/*.jpg" --requests 500 --batch 8
+    python -m benchmarks.replay --synthetic 60
+"""
+
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+
+from config import Config
+from Camera.camera import Camera
+from Camera.frame_source import VideoSource, ImageSequenceSource
+from ImageProcessing.preprocess_maze import MazePipeline
+from Server import protocol
+from Server.server import DirectionsServer
+from main import MazeManager
+from metrics import metrics
+
+# stages in the order they are reported
+STAGES = ("threshold", "warp", "skeletonize", "aruco", "search", "update_step", "frame_wait", "request")
+
+
+class StageTimer(object):
+    """
+    collects the durations of the stages, wraps the methods that run them
+    """
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+        # wrapped methods that are running on every thread, so recursive calls are timed once
+        self.running = threading.local()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, function, exclude=None):
+        """
+        times every outermost call of a function
+        :param stage: stage to record the durations in
+        :param function: function to time
+        :param exclude: stage whose time during the call is not counted, such as waiting for a frame
+        :return: function
+        """
+        def timed(*args, **kwargs):
+            running = getattr(self.running, "stages", None)
+            if running is None:
+                running = self.running.stages = {}
+            if running.get(stage):
+                return function(*args, **kwargs)
+            running[stage] = True
+            excluded = self.total(exclude) if exclude else 0
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if exclude:
+                    duration -= self.total(exclude) - excluded
+                running[stage] = False
+                self.add(stage, duration)
+        return timed
+
+    def total(self, stage):
+        with self.lock:
+            return sum(self.samples.get(stage, []))
+
+    def report(self):
+        """
+        :return: dict of stage to its count and latency percentiles in milliseconds
+        """
+        report = {}
+        for stage in STAGES + tuple(sorted(set(self.samples) - set(STAGES))):
+            samples = self.samples.get(stage)
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000
+            report[stage] = {"count": len(ms),
+                             "mean_ms": float(ms.mean()),
+                             "p50_ms": float(np.percentile(ms, 50)),
+                             "p90_ms": float(np.percentile(ms, 90)),
+                             "p99_ms": float(np.percentile(ms, 99)),
+                             "max_ms": float(ms.max())}
+        return report
+
+
+def create_replay_source(paths, frame_rate, stream_resolution):
+    """
+    :param paths: a video file, or image files and glob patterns of a recorded frame sequence
+    :return: FrameSource
+    """
+    if len(paths) == 1 and os.path.splitext(paths[0])[1].lower() not in (".jpg", ".jpeg", ".png", ".bmp") \
+            and not any(char in paths[0] for char in "*?["):
+        return VideoSource(paths[0], frame_rate, stream_resolution=stream_resolution)
+    return ImageSequenceSource(paths if len(paths) > 1 else paths[0], frame_rate,
+                               stream_resolution=stream_resolution)
+
+
+def draw_marker(img, marker_id, center, size):
+    dictionary = cv2.aruco.getPredefinedDictionary(Config.aruco_dict)
+    # drawMarker was renamed in opencv 4.7
+    generate = getattr(cv2.aruco, "generateImageMarker", None) or cv2.aruco.drawMarker
+    marker = generate(dictionary, marker_id, size)
+    # white quiet zone around the marker
+    marker = cv2.copyMakeBorder(marker, size // 4, size // 4, size // 4, size // 4, cv2.BORDER_CONSTANT, value=255)
+    top, left = int(center[0]) - marker.shape[0] // 2, int(center[1]) - marker.shape[1] // 2
+    img[top:top + marker.shape[0], left:left + marker.shape[1]] = marker
+
+
+def write_synthetic_recording(directory, frames, resolution=(2592, 1936), seed=0):
+    """
+    writes a recording of a car driving along a corridor of a synthetic maze
+    :param directory: directory to write the frames to
+    :param frames: number of frames with the car
+    :return: (path of the board image without the car, glob pattern of the frames)
+    """
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    board = np.full((height, width), 60, np.uint8)
+    cv2.fillPoly(board, [np.int32([[420, 260], [2250, 300], [2200, 1720], [380, 1680]])], 200)
+    # a corridor from the start to the end with random branches
+    corridor = [(500, 600), (500, 1900), (1300, 1900)]
+    for start, end in zip(corridor, corridor[1:]):
+        cv2.line(board, start[::-1], end[::-1], 30, 14)
+    for _ in range(12):
+        p = rng.integers([400, 600], [1500, 2000], 2)
+        q = p + rng.integers(-300, 300, 2) * np.eye(2, dtype=int)[rng.integers(0, 2)]
+        cv2.line(board, tuple(int(v) for v in p[::-1]), tuple(int(v) for v in q[::-1]), 30, 14)
+    board = np.clip(board + rng.normal(0, 3, board.shape), 0, 255).astype(np.uint8)
+    board_path = os.path.join(directory, "board.png")
+    cv2.imwrite(board_path, board)
+    draw_marker(board, Config.END_ID, corridor[-1], 60)
+    for index in range(frames):
+        frame = board.copy()
+        col = corridor[0][1] + 40 + (corridor[1][1] - corridor[0][1] - 200) * index // max(frames - 1, 1)
+        draw_marker(frame, Config.BACKWARD_CAR_ID, (corridor[0][0], col), 60)
+        draw_marker(frame, Config.FORWARD_CAR_ID, (corridor[0][0], col + 100), 60)
+        cv2.imwrite(os.path.join(directory, f"frame{index:05d}.png"), frame)
+    return board_path, os.path.join(directory, "frame*.png")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def connect(port, timeout=10):
+    # the server thread may not listen yet
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def simulate_robot(port, requests, batch, timer):
+    """
+    asks the directions server for directions like the ESP32 does
+    :param port: port of the directions server on localhost
+    :param requests: number of requests to send
+    :param batch: most steps to accept in one reply, 0 for single direction replies
+    :return: number of replies of every direction type
+    """
+    replies = {}
+    reader = protocol.MessageReader()
+    request = protocol.create_message(Config.opcodes['DIRECTION_REQUEST'], Config.dev_codes['ESP_32'],
+                                      Config.dev_codes['RPI'], batch, 0, 0, 0)
+    with connect(port) as sock:
+        for _ in range(requests):
+            start = time.perf_counter()
+            sock.sendall(request)
+            messages = []
+            while not messages:
+                if reader.recv_into(sock) == 0:
+                    return replies
+                messages = reader.messages()
+            timer.add("request", time.perf_counter() - start)
+            for message in messages:
+                steps = message.get("steps") or [(message["direction"],)]
+                replies[steps[0][0]] = replies.get(steps[0][0], 0) + 1
+                if steps[0][0] == Config.finished:
+                    return replies
+    return replies
+
+
+def instrument(manager, timer):
+    # times the stages of the manager that run while directions are served
+    mi = manager._mi
+    mi.load_aruco_image = timer.wrap("aruco", mi.load_aruco_image)
+    mi.update_pose = timer.wrap("aruco", mi.update_pose)
+    manager.plan_directions = timer.wrap("search", manager.plan_directions)
+    manager.wait_for_new_frame = timer.wrap("frame_wait", manager.wait_for_new_frame)
+    manager.update_step = timer.wrap("update_step", manager.update_step, exclude="frame_wait")
+
+
+def run_replay(paths, board_path=None, frame_rate=None, requests=200, batch=0, pipeline_runs=3):
+    """
+    :param paths: recording to replay, see create_replay_source
+    :param board_path: image of the board without the car, None to load the maze from the first frame
+    :param frame_rate: replay frame rate, None for Config.frame_rate
+    :param requests: number of direction requests the simulated robot sends
+    :param batch: most steps the simulated robot accepts in one reply
+    :param pipeline_runs: extra runs of the maze processing stages on the board
+    :return: report dict
+    """
+    timer = StageTimer()
+    source = create_replay_source(paths, frame_rate or Config.frame_rate, Config.tracking_resolution)
+    camera = Camera(camera_resolution=source.resolution, frame_rate=frame_rate or Config.frame_rate,
+                    buffer_size=Config.frame_buffer_size, source=source)
+    manager = MazeManager(camera=camera)
+    port = free_port()
+    manager.server = DirectionsServer("127.0.0.1", port, manager)
+    instrument(manager, timer)
+
+    board = cv2.imread(board_path, cv2.IMREAD_GRAYSCALE) if board_path else source.capture_still()
+    pipeline = MazePipeline()
+    for _ in range(pipeline_runs):
+        timings = {}
+        pipeline.run(board, timings)
+        for stage in ("threshold", "warp", "skeletonize"):
+            timer.add(stage, timings[stage])
+
+    manager.init_capture()
+    manager.cam.wait_for_frame(0, 10)
+    if board_path:
+        Config.image_file = board_path
+    manager.load_env(from_file=board_path is not None)
+    for stage in ("threshold", "warp", "skeletonize"):
+        if stage in manager._mi.stage_timings:
+            timer.add(stage, manager._mi.stage_timings[stage])
+    manager.restart_maze()
+    manager.start_solver()
+
+    threading.Thread(target=manager.server.start_server, daemon=True).start()
+    start = time.perf_counter()
+    replies = simulate_robot(port, requests, batch, timer)
+    elapsed = time.perf_counter() - start
+    manager.end_run()
+    return {"recording": paths,
+            "board": board_path,
+            "path_found": manager.status["path_found"],
+            "requests_per_second": sum(replies.values()) / elapsed,
+            "camera_fps": manager.cam.get_fps(),
+            "replies": {str(direction): count for direction, count in replies.items()},
+            "stages": timer.report(),
+            # the spans the solver records itself, see metrics.py
+            "metrics": metrics.snapshot()}
+
+
+def print_report(report):
+    print(f"path found: {report['path_found']}, {report['requests_per_second']:.1f} requests/s, "
+          f"camera {report['camera_fps']:.1f} fps")
+    print(f"{'stage':<12} {'count':>6} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<12} {stats['count']:>6} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+              f"{stats['p90_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replays a recording through the maze solver")
+    parser.add_argument("recording", nargs="*", help="video file, or frame images / glob patterns")
+    parser.add_argument("--board", help="image of the board without the car, default is the first frame")
+    parser.add_argument("--synthetic", type=int, default=0, help="replay a synthetic recording of this many frames")
+    parser.add_argument("--frame-rate", type=float, help="replay frame rate, default is Config.frame_rate")
+    parser.add_argument("--requests", type=int, default=200, help="direction requests of the simulated robot")
+    parser.add_argument("--batch", type=int, default=0, help="most steps the simulated robot accepts per reply")
+    parser.add_argument("--pipeline-runs", type=int, default=3, help="extra runs of the maze processing stages")
+    parser.add_argument("--cache", action="store_true", help="use the maze cache, it skips the processing stages")
+    parser.add_argument("--report", default="replay_report.json", help="file to write the report to")
+    parser.add_argument("--trace", help="file to write the control cycle trace to (JSON lines)")
+    args = parser.parse_args()
+    if not args.cache:
+        Config.maze_cache_dir = None
+    Config.trace_file = args.trace
+    with tempfile.TemporaryDirectory() as directory:
+        recording, board = args.recording, args.board
+        if args.synthetic:
+            board, pattern = write_synthetic_recording(directory, args.synthetic)
+            recording = [pattern]
+        if not recording:
+            parser.error("give a recording or --synthetic")
+        report = run_replay(recording, board, args.frame_rate, args.requests, args.batch, args.pipeline_runs)
+    print_report(report)
+    with open(args.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
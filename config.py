@@ -9,6 +9,16 @@ class Config:
     webserver_port = 7000
     # port to serve commands server on
     port = 8080
+    # number of threads that run the solver work of the directions server (one per robot is enough)
+    directions_workers = 2
+    # frames per second and width of the frames streamed to the app when it does not choose them
+    stream_default_fps = 5
+    stream_default_width = 480
+    # highest frames per second and width the app can ask the stream for
+    stream_max_fps = 15
+    stream_max_width = 1296
+    # JPEG quality of the streamed frames (0 to 100)
+    stream_jpeg_quality = 70
 
     # Movement Configurations
 
@@ -20,6 +30,14 @@ class Config:
     rotation_sensitivity = 8
     # minimum number of consecutive actions for solver to consider a movement
     min_actions_for_movement = 10
+    # simplification of the solver's path into straight segments:
+    # "run_length" - merges runs of the same action (drops diagonals and runs shorter than min_actions_for_movement),
+    # "rdp" - the fewest segments within path_simplify_tolerance that stay in a corridor around the maze lines
+    path_simplifier = "run_length"
+    # largest distance in pixels of the path from the segment that replaces it ("rdp")
+    path_simplify_tolerance = 5
+    # pixels the segments may leave the maze lines by ("rdp")
+    path_corridor_width = 6
     # minimum pixels for aruco to move to consider a movement
     moved_sensitivity = 30
     # number of pixels for car to be apart from its destination to consider as moved
@@ -36,6 +54,32 @@ class Config:
     natural_error = 0
     # number of pixels for the car to be apart from its destination to consider as finished
     accuracy_threshold_for_complete = 60
+    # compute the next direction from every new camera frame in the background so direction requests
+    # are answered right away (the PID is then updated once per frame instead of once per request)
+    prefetch_directions = False
+
+    # Search Configurations
+
+    # search agent used to solve the maze, one of ImageProcessing.search_agents.SEARCH_AGENTS
+    # "weighted" - object based weighted A*, "array" - weighted A* over flat cell indices,
+    # "graph" - A* over the junction graph of the skeleton,
+    # "incremental" - D* Lite that repairs its last search when the car or the maze changes,
+    # "distance_field" - reads the path from a distance field to the end point,
+    # "theta" - any-angle A* (theta*) that plans straight segments in any direction inside the maze lines
+    search_agent = "weighted"
+    # heuristic of the "weighted" and "array" agents: "manhattan" - distance to the end point through the walls,
+    # replanning prefers the last path, "distance_field" - exact cost to the end point read from the distance field
+    search_heuristic = "manhattan"
+    # pixels the segments of the "theta" agent may leave the drawn maze lines by (on top of half of line_width)
+    any_angle_margin = 2
+    # compute the distance field to the end point whenever the end aruCo moves
+    # (otherwise it is computed the first time it is needed)
+    distance_field = False
+    # number of changed maze cords above which the incremental agent searches from scratch
+    incremental_max_changed_cells = 20000
+    # build the junction graph of the skeleton when loading the initial image, only the "graph" agent uses it
+    # (otherwise it is built the first time the "graph" agent needs it)
+    build_maze_graph = False
 
     # PID params
 
@@ -62,12 +106,17 @@ class Config:
                       "DIAG_UL": 5, "DIAG_UR": 5, "DIAG_DL": 5, "DIAG_DR": 5, "STAY": 5}
     action_vectors = {"UP": (-1, 0), "DOWN": (1, 0), "LEFT": (0, -1), "RIGHT": (0, 1),
        "DIAG_UL": (-1, -1), "DIAG_UR": (-1, 1), "DIAG_DL": (1, -1), "DIAG_DR": (1, 1)}
+    # cost of each action for the solver
+    action_costs = {"UP": 1, "DOWN": 1, "LEFT": 1, "RIGHT": 1,
+                    "DIAG_UL": 10, "DIAG_UR": 10, "DIAG_DL": 10, "DIAG_DR": 10}
     # opcodes according to communication protocol
     opcodes = {
         "DIRECTION_REQUEST": 1,
         "DIRECTION_MSG": 2,
         "ESP32_ACK": 3,
-        "Control": 4
+        "Control": 4,
+        # several direction steps in one message, see Server/protocol.py
+        "DIRECTION_BATCH": 5
     }
     # device codes according to communication protocol
     dev_codes = {
@@ -78,6 +127,17 @@ class Config:
 
     # logging file
     logging_file = "./maze_solver.log"
+    # lowest level written to the logging file ("DEBUG", "INFO", "WARNING", ...)
+    logging_level = "DEBUG"
+    # most log records per second from one line of code, records of level WARNING and above are never dropped.
+    # 0 does not limit
+    log_rate_limit = 5
+    # file to write a JSON line per control cycle to (pose, errors and the command sent), None to not trace
+    trace_file = None
+    # number of newest samples every metrics histogram keeps
+    metrics_window = 1000
+    # file to append every timing span to as JSON lines, None to not dump them
+    metrics_file = None
 
     # Image Processing Configurations
 
@@ -92,11 +152,53 @@ class Config:
     zoom = (0.22, 0.0, 0.7, 0.8)
     # frame rate
     frame_rate = 9
+    # number of frames kept by the camera, a frame handed out without copying stays intact
+    # for this many captures minus one
+    frame_buffer_size = 3
+    # seconds to wait for a new frame before a direction step uses the newest one
+    frame_wait_timeout = 0.5
+    # source of the camera frames: "picamera", "video" (a recorded video or a pattern like "frames/%04d.png")
+    # or "images" (a glob of image files), recordings are replayed at frame_rate
+    camera_source = "picamera"
+    # path of the recording replayed by the "video" and "images" sources
+    camera_replay_path = None
+    # capture format of the pi camera: "yuv" reads the luma plane as the grayscale frame,
+    # "bgr" captures color and converts it
+    camera_capture_format = "yuv"
+    # resolution of the live frames used to track the car, the maze is extracted from a still at
+    # camera_resolution and the warp matrix is scaled to the live frames. None tracks at camera_resolution,
+    # a smaller (width, height) with the aspect ratio of camera_resolution such as (648, 484) tracks faster
+    # with less precise poses
+    tracking_resolution = None
+    # segmentation of the initial image: "full" - adaptive threshold on the full frame,
+    # "downsampled" - finds the board on a downsampled frame and thresholds the lines only inside it
+    threshold_mode = "full"
+    # factor the frame is downsampled by in the "downsampled" threshold mode
+    threshold_downsample = 8
+    # thinning used to skeletonize the maze: "skimage", "opencv" (needs the opencv contrib ximgproc module,
+    # otherwise falls back to "lut") or "lut" (lookup table zhang-suen thinning)
+    skeleton_backend = "skimage"
+    # directory to write the intermediate images of the maze processing to (thresh.jpg, mask.jpg,
+    # warped-convex.jpg), they are written on a background thread. None does not write them
+    debug_images_dir = None
+    # directory of the cache of processed mazes, an unchanged board is restored from it instead of
+    # being processed again. None disables the cache
+    maze_cache_dir = None
+    # size limit of the maze cache in bytes, the least recently used mazes are removed first
+    maze_cache_max_bytes = 200 * 1024 * 1024
+    # largest number of differing bits between the perceptual hashes of two frames of the same board
+    maze_cache_max_distance = 6
+    # largest distance in pixels of camera_resolution a corner of the board may have moved by for its cached
+    # maze to be reused (the corners are found on the frame downsampled by threshold_downsample)
+    maze_cache_max_shift = 12
     # width of actual maze, allows for better perspective transformation
     maze_width = 1189
     # height of actual maze, allows for better perspective transformation
     maze_height = 849
     line_width = 4
+    # half the size of the part of the camera frame searched for the car around its last location,
+    # in pixels of camera_resolution (scaled down with the tracking frames)
+    pose_roi_size = 300
     # ID to use for the car, should not be an id used by any of the aruCos
     CAR_ID = 4
     # the aruCo ID used for the back of the car
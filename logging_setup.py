@@ -0,0 +1,124 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+from config import Config
+
+"""
+Logging setup module
+
+the control loop only puts log records on a queue, a background thread writes them to the log file
+so slow writes to the SD card do not hold up the direction requests. records below WARNING are
+rate limited per line of code, so a debug message in the request loop cannot flood the queue.
+
+the trace mode writes one JSON line per control cycle (pose, errors and the command sent) to
+Config.trace_file the same way, for analysing runs afterwards.
+"""
+
+_lock = threading.Lock()
+_listeners = []
+_trace_logger = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    lets through at most a number of records per second from every line of code,
+    records of level WARNING and above always pass
+    """
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        # (path, line) to [start of the current second, records let through, records dropped]
+        self.windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.per_second:
+            return True
+        key = (record.pathname, record.lineno)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= 1:
+            dropped = window[2] if window is not None else 0
+            window = self.windows[key] = [record.created, 0, 0]
+            if dropped:
+                record.msg = f"{record.msg} ({dropped} similar messages dropped)"
+        if window[1] >= self.per_second:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    # the cycle dicts are serialized on the writer thread instead of in the control loop
+    def prepare(self, record):
+        return record
+
+
+class _JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(dict(record.msg, time=record.created), default=str)
+
+
+def _start_listener(handler):
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return records
+
+
+def setup_logging(filename=None, level=None, rate_limit=None, trace_file=None):
+    """
+    sets up the logging of the process, only the first call has an effect
+    :param filename: log file, None for Config.logging_file
+    :param level: name of the lowest level to log, None for Config.logging_level
+    :param rate_limit: most records per second from one line of code below WARNING, None for Config.log_rate_limit
+    :param trace_file: file of the control cycle trace, None for Config.trace_file (None there disables tracing)
+    :return: None
+    """
+    global _trace_logger
+    with _lock:
+        if _listeners:
+            return
+        root = logging.getLogger()
+        root.setLevel(level or Config.logging_level)
+        file_handler = logging.FileHandler(filename or Config.logging_file)
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(message)s"))
+        handler = logging.handlers.QueueHandler(_start_listener(file_handler))
+        handler.addFilter(RateLimitFilter(Config.log_rate_limit if rate_limit is None else rate_limit))
+        root.addHandler(handler)
+
+        trace_file = trace_file or Config.trace_file
+        if trace_file:
+            trace_handler = logging.FileHandler(trace_file)
+            trace_handler.setFormatter(_JsonLinesFormatter())
+            _trace_logger = logging.getLogger("trace")
+            _trace_logger.setLevel(logging.INFO)
+            # the trace is not part of the log file
+            _trace_logger.propagate = False
+            _trace_logger.addHandler(_TraceQueueHandler(_start_listener(trace_handler)))
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    # writes the queued records
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+
+
+def is_tracing():
+    return _trace_logger is not None
+
+
+def trace(fields):
+    """
+    records a control cycle in the trace, if tracing is enabled
+    :param fields: dict of the cycle's values (json serializable), the dict must not be changed afterwards
+    :return: None
+    """
+    if _trace_logger is not None:
+        _trace_logger.info(fields)
@@ -7,11 +7,17 @@ import math
 import signal
 
 from Camera.camera import Camera
+from Camera.frame_source import create_frame_source
 from config import Config
-from ImageProcessing.preprocess_maze import MazeImage
+from ImageProcessing.preprocess_maze import MazeImage, MazePipeline, DebugImageWriter
+from ImageProcessing.maze_cache import MazeCache
 from ImageProcessing.search_env import MazeSearchEnv
-from ImageProcessing.search_agents import Heuristic1, WeightedAStarAgent, ContextHeuristic
+from ImageProcessing.search_agents import ContextHeuristic, create_agent, create_heuristic
+from ImageProcessing.path_simplify import get_corridor, simplify_path, segments_to_directions
 from Server.server import DirectionsServer, ControlServer
+from Server.jobs import JobCancelled
+from metrics import metrics
+from logging_setup import setup_logging, is_tracing, trace
 from Robot.robot import Robot
 
 
@@ -22,6 +28,11 @@ def dist(c1, c2):
 
 # change dist here to be L1 not L2
 def get_distance_left(current_loc, src, dst, action_type):
+    if src[0] != dst[0] and src[1] != dst[1]:
+        # a diagonal segment (see ImageProcessing.path_simplify), the distance left is
+        # the projection of the way to dst on the segment, negative once dst was passed
+        segment = (dst[0] - src[0], dst[1] - src[1])
+        return ((dst[0] - current_loc[0]) * segment[0] + (dst[1] - current_loc[1]) * segment[1]) / size(segment)
     if src[0] == dst[0]:
         num_left = np.sign(dst[1] - current_loc[1])
         if num_left == np.sign(Config.action_vectors[action_type][1]):
@@ -61,7 +72,8 @@ def calculate_cos_theta(next_direction, current_direction):
             return -rotation_amount
         else:
             return rotation_amount
-    return angle_1 - angle_2
+    # segments that are not along an axis, same sign as the cases above
+    return (angle_2 - angle_1 + 180) % 360 - 180
 
 
 
@@ -107,11 +119,23 @@ def distance_from_line(line_point1, line_point2, point):
 
 
 class MazeManager(object):
-    def __init__(self):
-        logging.basicConfig(filename=Config.logging_file, level=logging.DEBUG)
-        self.cam = Camera(camera_resolution=Config.camera_resolution,
-                          frame_rate=Config.frame_rate, zoom=Config.zoom)
-        self._mi = MazeImage(Config.aruco_dict)
+    def __init__(self, camera=None):
+        """
+        :param camera: Camera to take the frames from, None for a camera over Config.camera_source
+        """
+        setup_logging()
+        if camera is None:
+            source = create_frame_source(Config.camera_source, Config.camera_resolution, Config.frame_rate,
+                                         Config.zoom, capture_format=Config.camera_capture_format,
+                                         path=Config.camera_replay_path, stream_resolution=Config.tracking_resolution)
+            camera = Camera(camera_resolution=Config.camera_resolution,
+                            frame_rate=Config.frame_rate, zoom=Config.zoom, buffer_size=Config.frame_buffer_size,
+                            source=source)
+        self.cam = camera
+        cache = MazeCache(Config.maze_cache_dir, Config.maze_cache_max_bytes, Config.maze_cache_max_distance) \
+            if Config.maze_cache_dir else None
+        pipeline = MazePipeline(DebugImageWriter(Config.debug_images_dir) if Config.debug_images_dir else None)
+        self._mi = MazeImage(Config.aruco_dict, cache, pipeline)
         self.agent = None
         self.maze_env = None
         self.stopped = True
@@ -121,6 +145,9 @@ class MazeManager(object):
                            natural_error=Config.natural_error)
         self.movement_coef = 8
         self.rotation_err = 0
+        # distance of the car from the line it follows, after the line width is taken off
+        self.line_err = 0
+        # one car is tracked, so every robot that connects shares this manager as its solver context
         self.server = DirectionsServer(Config.host, Config.port, self)
         self.control_server = ControlServer(Config.host, Config.webserver_port, self)
         self.last_interval = 0
@@ -131,12 +158,21 @@ class MazeManager(object):
         self.last_turn = [0, 0]
         self.finished = False
         self.is_running = True
+        # sequence number of the camera frame the car's location was last taken from
+        self.pose_sequence = 0
+        # whether a background worker keeps the next direction computed from the newest frame
+        self.prefetching = False
+        # (next direction, capture time of the frame it was computed from) kept by the worker
+        self.prefetched = None
+        self.prefetch_lock = threading.Lock()
         self.status = {
             "connection": True,
             "path_found": False,
             "running": False,
             "calculating_path": False,
             "initial_maze_loaded": False,
+            # seconds between the capture of the frame behind the last direction and sending it
+            "pose_age": None,
         }
 
     def get_status(self):
@@ -170,9 +206,23 @@ class MazeManager(object):
         if self.stopped:
             return self.cam.retrieve_image()
         if self.maze_env:
-            return self.maze_env.get_warped_image()
+            # the newest frame is copied out of the camera's ring buffer only when the app asks for it
+            return self.maze_env.get_warped_image(self.cam.retrieve_image())
         return self.cam.retrieve_image()
 
+    def get_status_frame(self):
+        """
+        gets the image to display on the app with a key that changes whenever the image does,
+        and the planned path on it when the solver runs
+        :return: numpy array, key, list of (row, col) or None
+        """
+        sequence = self.cam.get_sequence()
+        if self.stopped or not self.maze_env:
+            # a copy, the camera may overwrite a ring buffer view while the frame is encoded
+            return self.cam.retrieve_image(), (sequence, None), None
+        path = [tuple(self.last_turn)] + [tuple(cord) for cord in self.cords]
+        return self.maze_env.get_warped_image(self.cam.retrieve_image()), (sequence, len(path)), path
+
     def is_stopped(self):
         # returns if solver is stopped
         return self.stopped
@@ -190,46 +240,66 @@ class MazeManager(object):
     def reload_initial_image(self):
         # reloads the initial image of just the maze from the camera
         self.stopped = True
-        self.maze_env.load_initial_image(self.cam.retrieve_image())
+        self.maze_env.load_initial_image(self.cam.capture_still())
 
-    def load_env(self, from_file=False):
+    def load_env(self, from_file=False, progress=None):
         """
         loads the maze env either from a file or camera's feed
         :param from_file: whether to load from file or not
+        :param progress: function (part done, stage name) to report progress to, it may raise JobCancelled
         :return: None
         """
-        print("1")
+        progress = progress or (lambda part, stage: None)
         self.stopped = True
         self.status['path_found'] = False
         self.status['initial_maze_loaded'] = False
+        # a new maze invalidates any search state kept by the agent
+        self.agent = None
         # loads maze without aruco
+        progress(0.0, "capture")
         if from_file:
             im = cv2.imread(Config.image_file, cv2.IMREAD_GRAYSCALE)
         else:
-            print("2")
-            im = self.cam.retrieve_image()
-        print("3")
-        self._mi.load_initial_image(im)
-        print("4")
+            # the thin maze lines need the full resolution
+            im = self.cam.capture_still()
+        # the processing stages make up the rest of the job
+        self._mi.load_initial_image(im, lambda part, stage: progress(0.1 + 0.9 * part, stage))
         self.status["initial_maze_loaded"] = True
 
-    def restart_maze(self):
-        # resets maze to starting conditions and reloads directions
+    def restart_maze(self, progress=None):
+        """
+        resets maze to starting conditions and reloads directions
+        :param progress: function (part done, stage name) to report progress to, it may raise JobCancelled
+        :return: None
+        """
+        progress = progress or (lambda part, stage: None)
         try:
+            progress(0.0, "locate")
             self.finished = False
             self.status['calculating_path'] = True
             self.status['path_found'] = False
             self.robot.reset_angle_pid()
             self.robot.reset_dir_pid()
-            self._mi.load_aruco_image(self.cam.retrieve_image())
+            self.reload_frame_info()
+            progress(0.3, "search")
             self.maze_env = MazeSearchEnv(self._mi)
-            self.agent = WeightedAStarAgent(self.maze_env, 0.5, Heuristic1())
+            if getattr(self.agent, "incremental", False):
+                # keeps the search state, the agent repairs what changed since its last search
+                self.agent.env = self.maze_env
+            else:
+                self.agent = create_agent(Config.search_agent, self.maze_env, 0.5,
+                                          create_heuristic(Config.search_heuristic))
             self.update_directions()
             self.is_rotating = True
             self.status['calculating_path'] = False
-        except:
+        except JobCancelled:
             self.status['calculating_path'] = False
-
+            raise
+        except Exception as e:
+            # raised again so the reset job is reported as failed
+            self.status['calculating_path'] = False
+            logging.error(f"restarting the maze failed: {repr(e)}")
+            raise
 
     def update_directions(self):
         """
@@ -240,29 +310,54 @@ class MazeManager(object):
         if not self.stopped:
             self.stopped = True
             changed_stop = True
-        self.server.updating_started()
         self.status['calculating_path'] = True
         self.reload_image()
-        self.directions = self.get_directions()
+        directions, cords = self.plan_directions()
+        # only swapping in the new plan holds up the directions server
+        self.server.updating_started()
+        self.set_directions(directions, cords)
         self.status['calculating_path'] = False
         self.server.finished_updating()
         if changed_stop:
             self.stopped = False
 
+    def reload_frame_info(self):
+        # loads the aruCo information from the newest camera frame without copying it
+        image, sequence, capture_time = self.cam.get_frame()
+        self._mi.load_aruco_image(image, capture_time)
+        self.pose_sequence = sequence
+
     def reload_image(self):
         # reloads image from camera
-        self.maze_env.load_image(self.cam.retrieve_image())
+        image, sequence, capture_time = self.cam.get_frame()
+        self.maze_env.load_image(image, capture_time)
+        self.pose_sequence = sequence
+
+    def reload_pose(self):
+        # updates the car's location from the camera, a frame is only processed once
+        image, sequence, capture_time = self.cam.get_frame()
+        if sequence == self.pose_sequence:
+            return
+        self.maze_env.update_pose(image, capture_time)
+        self.pose_sequence = sequence
+
+    def wait_for_new_frame(self):
+        # blocks until the camera has a frame newer than the one the car's location was taken from
+        with metrics.span("frame_wait"):
+            frame = self.cam.wait_for_frame(self.pose_sequence, Config.frame_wait_timeout)
+        if frame is None:
+            logging.debug("no new frame from camera")
 
     def get_current_coords(self):
         # returns the current car coordinates
-        # reloads image
-        self.reload_image()
+        # reloads the car's location
+        self.reload_pose()
         current_cords = self.maze_env.get_current_coords()
         return current_cords
 
     def get_forward_coords(self):
         # gets the coordinates of the forward aruco on car
-        self.reload_image()
+        self.reload_pose()
         current_cords = self.maze_env.get_forward_coords()
         return current_cords
 
@@ -300,23 +395,140 @@ class MazeManager(object):
             t = threading.Thread(target=self.control_server.start_server)
             t.start()
 
+    def start_prefetch(self):
+        """
+        starts a background worker that computes the next direction from every new frame,
+        so direction requests are answered without waiting for the vision
+        :return: None
+        """
+        self.prefetching = True
+        t = threading.Thread(target=self.prefetch_directions, daemon=True)
+        t.start()
+
+    def stop_prefetch(self):
+        # stops the prefetch worker
+        self.prefetching = False
+
+    def compute_next_direction(self):
+        """
+        advances the solver and gets the next direction, like a direction request without prefetching
+        :return: (direction_type: int, left_speed: int, right_speed: int, duration: int)
+        """
+        if self.is_stopped():
+            return Config.stay, 0, 0, 0
+        # the worker already waited for the frame
+        with metrics.span("update_step"):
+            self.update_step(new_frame=False)
+        if self.is_finished():
+            return Config.finished, 0, 0, 0
+        if self.server.lock.locked():
+            return Config.stay, 0, 0, 0
+        return self.get_dynamic_next_direction()
+
+    def prefetch_directions(self):
+        # worker that keeps the next direction computed from the newest frame
+        sequence = self.cam.get_sequence()
+        while self.prefetching:
+            frame = self.cam.wait_for_frame(sequence, Config.frame_wait_timeout)
+            if frame is None:
+                continue
+            _, sequence, capture_time = frame
+            try:
+                direction = self.compute_next_direction()
+            except Exception as e:
+                logging.error(f"prefetch error: {repr(e)}")
+                direction = (Config.stay, 0, 0, 0)
+            if is_tracing():
+                trace(self.get_cycle_trace(direction))
+            # the pose is from the newest frame update_step used, or from this frame if it did not need one
+            pose_time = self._mi.pose_timestamp if self._mi.pose_timestamp is not None else capture_time
+            with self.prefetch_lock:
+                self.prefetched = (direction, pose_time)
+
+    def get_prefetched_direction(self):
+        """
+        gets the direction computed by the prefetch worker and records how old its pose is.
+        a movement from a pose older than Config.frame_wait_timeout is not sent again, the robot stays
+        until a new frame arrives
+        :return: (direction_type: int, left_speed: int, right_speed: int, duration: int)
+        """
+        with self.prefetch_lock:
+            prefetched = self.prefetched
+        if prefetched is None:
+            return Config.stay, 0, 0, 0
+        direction, pose_time = prefetched
+        self.status['pose_age'] = time.time() - pose_time
+        if self.status['pose_age'] > Config.frame_wait_timeout and direction[0] not in (Config.stay, Config.finished):
+            logging.debug(f"direction {direction} is from a pose {self.status['pose_age'] * 1000:.0f} ms old, "
+                          f"staying")
+            return Config.stay, 0, 0, 0
+        logging.debug(f"sending direction {direction} from a pose {self.status['pose_age'] * 1000:.0f} ms old")
+        return direction
+
+    def get_cycle_trace(self, direction):
+        """
+        gets the values of a control cycle for the trace
+        :param direction: (direction_type, left_speed, right_speed, duration) sent for the cycle
+        :return: dict
+        """
+        pose = None
+        if self.maze_env and self._mi.aruco is not None and self._mi.aruco.has_car():
+            pose = [int(value) for value in self.get_last_coords()]
+        return {"sequence": self.pose_sequence,
+                "pose": pose,
+                "rotating": self.is_rotating,
+                "rotation_err": float(self.rotation_err),
+                "line_err": float(self.line_err),
+                "distance_left": int(self.directions[0][1]) if self.directions else None,
+                "command": [int(value) for value in direction]}
+
     def get_directions(self):
         # gets new directions by solving the maze
-        actions, cost, expanded = self.agent.run_search()
+        directions, cords = self.plan_directions()
+        self.set_directions(directions, cords)
+        return self.directions
+
+    def plan_directions(self):
+        """
+        solves the maze without touching the current directions
+        :return: (list of actions of form (ACTION_TYPE, int), list of cords) or ([], None) if no path was found
+        """
+        with metrics.span("search") as span:
+            actions, cost, expanded = self.agent.run_search()
+            span["expanded"] = self.agent.expanded
+            span["found"] = int(cost != -1)
         if cost == -1:
             self.status['path_found'] = False
-            return []
+            return [], None
         else:
             cords = self.maze_env.actions_to_cords(actions)
-            # added to improve A star times
-            self.agent.heuristic = ContextHeuristic(cords)
+            # added to improve A star times, the distance field heuristic is exact and needs no hint of the last path
+            if not getattr(self.agent, "incremental", False) and Config.search_heuristic == "manhattan":
+                self.agent.heuristic = ContextHeuristic(cords)
             self.status['path_found'] = True
             logging.debug(f"found path: {cost != -1}")
+            waypoints = getattr(self.agent, "waypoints", None)
+            if waypoints:
+                # any-angle agents plan the segments themselves
+                return segments_to_directions(waypoints, Config.action_vectors), list(waypoints)
+            if Config.path_simplifier == "rdp":
+                corridor = get_corridor(self.maze_env.get_maze_mask(), Config.path_corridor_width)
+                turns = simplify_path(cords, corridor, Config.path_simplify_tolerance)
+                return segments_to_directions(turns, Config.action_vectors), turns
             smoothed_actions = self.process_actions(actions)
+            return smoothed_actions, self.maze_env.actions_to_cords_with_weight(smoothed_actions)
 
-            self.cords = self.maze_env.actions_to_cords_with_weight(smoothed_actions)
+    def set_directions(self, directions, cords):
+        """
+        sets the directions to follow
+        :param directions: list of actions of form (ACTION_TYPE, int)
+        :param cords: cords of the turns, starting with the current location. None to keep the old cords
+        :return: None
+        """
+        self.directions = directions
+        if cords is not None:
+            self.cords = cords
             self.last_turn = self.cords.pop(0)
-            return smoothed_actions
 
     def get_car_angle(self):
         # gets the car's angle
@@ -368,7 +580,7 @@ class MazeManager(object):
                     return Config.actions_to_num["RIGHT"], rot_speed, rot_speed, Config.rotation_interval_size
                 return Config.actions_to_num["STAY"], 0, 0, int(0)
             except Exception as e:
-                print(e)
+                logging.error(f"rotation speed error: {repr(e)}")
         else:
             if self.directions[0][1] > 0:
                 action = Config.actions_to_num["UP"]
@@ -378,15 +590,33 @@ class MazeManager(object):
             self.last_interval = amount
             speed_l, speed_r = self.robot.get_speeds()
             # reduce speed if we are close to point
-            print(f"speed L, R: {speed_l} , {speed_r}")
+            logging.debug(f"speed L, R: {speed_l} , {speed_r}")
             return action, int(speed_l), int(speed_r), int(self.movement_coef * amount)
 
+    def get_planned_directions(self, max_steps):
+        """
+        gets the next direction and the intervals that follow it on the current segment,
+        so the robot can run them without a request per interval. rotations are sent one at a time.
+        :param max_steps: most directions to return
+        :return: list of (direction_type: int, left_speed: int, right_speed: int, duration: int)
+        """
+        first = self.get_dynamic_next_direction()
+        steps = [first]
+        if self.is_rotating or not self.directions:
+            return steps
+        remaining = abs(self.directions[0][1]) - self.last_interval
+        while remaining > 0 and len(steps) < max_steps:
+            amount = min(remaining, Config.interval_size)
+            steps.append((first[0], first[1], first[2], int(self.movement_coef * amount)))
+            remaining -= amount
+        return steps
+
     def did_reach_end(self, current_loc):
         if dist(self.maze_env.get_end_point(), current_loc) < Config.accuracy_threshold_for_complete:
             return True
         return False
 
-    def update_step(self):
+    def update_step(self, new_frame=True):
         """
         Runs before every direction request.
         Updates:
@@ -395,13 +625,16 @@ class MazeManager(object):
             - transitions from rotation/forward/backward
             - movement coeficient
             - robot speeds
+        :param new_frame: wait for a camera frame that was not used yet
         :return: None
         """
         # if we have directions left and not in stand by mode
         if self.directions and not self.stopped:
+            if new_frame:
+                self.wait_for_new_frame()
             # check if reached end
             if self.is_rotating:
-                self.reload_image()
+                self.reload_pose()
                 rot_vec = (self.cords[0][0] - self.last_turn[0], self.cords[0][1]-self.last_turn[1])
                 self.rotation_err = calculate_cos_theta(rot_vec, self.maze_env.get_direction_vector())
                 # if we are off by less than sensitivity then stop rotation
@@ -410,7 +643,7 @@ class MazeManager(object):
                     self.robot.max_speed = Config.max_forward_speed
                     # starting forward movement so reset old errors
                     self.robot.reset_dir_pid()
-                    self.update_step()
+                    self.update_step(new_frame=False)
             else:
                 current_forward_location = self.get_forward_coords()
                 if self.did_reach_end(current_forward_location):
@@ -421,12 +654,13 @@ class MazeManager(object):
                     err = min(err+Config.line_width/2, 0)
                 if err > 0:
                     err = max(err-Config.line_width/2, 0)
+                self.line_err = err
                 self.robot.calc_speeds(err)
                 # update the amount to move to the amount left
                 try:
                     current_location = self.get_current_coords()
                 except:
-                    print("issue with aruco")
+                    logging.warning("issue with aruco")
                     self.stopped = True
                     return
                 temp = (self.directions[0][0], get_distance_left(current_location, self.last_turn, self.cords[0], self.directions[0][0]))
@@ -441,7 +675,7 @@ class MazeManager(object):
                     self.is_rotating = True
                     # just started rotating so reset old errors
                     self.robot.reset_angle_pid()
-                    self.update_step()
+                    self.update_step(new_frame=False)
         else:
             self.stopped = True
 
@@ -454,6 +688,8 @@ if __name__ == "__main__":
     manager = MazeManager()
     # start capturing images
     manager.init_capture()
+    if Config.prefetch_directions:
+        manager.start_prefetch()
     time.sleep(0.5)
     # manager.cam.save_image("saved.jpg")
     # start control server
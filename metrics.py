@@ -0,0 +1,165 @@
+import atexit
+import collections
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+from config import Config
+
+"""
+Metrics module
+
+timing spans around the hot paths of the solver (maze processing stages, aruCo detection, search,
+update_step and the direction requests). every span is added to a rolling histogram of its name,
+the ControlServer's metrics command reports the histograms and the spans can also be appended
+to a file as JSON lines, which a background thread writes so the timed code does not wait for the disk.
+    with metrics.span("search") as span:
+        actions, cost, expanded = agent.run_search()
+        span["expanded"] = expanded
+"""
+
+
+class RollingHistogram(object):
+    """
+    keeps the newest samples of a value and summarizes them
+    """
+    def __init__(self, window):
+        """
+        :param window: number of newest samples to keep
+        """
+        self.samples = collections.deque(maxlen=window)
+        # number of samples ever added
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        """
+        :return: dict with the total count and the mean, percentiles and max of the kept samples
+        """
+        values = np.array(self.samples, dtype=np.float64)
+        p50, p90, p99 = np.percentile(values, (50, 90, 99))
+        return {"count": self.count,
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(values.max())}
+
+
+class Span(object):
+    """
+    times a block of code, extra values of the block can be set like in a dict
+    """
+    __slots__ = ("metrics", "name", "fields", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.fields = None
+        self.start = 0
+
+    def __setitem__(self, key, value):
+        if self.fields is None:
+            self.fields = {}
+        self.fields[key] = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.fields)
+        return False
+
+
+class Metrics(object):
+    def __init__(self, window=1000, dump_file=None):
+        """
+        :param window: number of newest samples every histogram keeps
+        :param dump_file: file to append every span to as a JSON line, None to not dump
+        """
+        self.window = window
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.dump = None
+        self.dump_queue = None
+        self.dump_thread = None
+        if dump_file:
+            self.dump = open(dump_file, "a")
+            self.dump_queue = queue.SimpleQueue()
+            self.dump_thread = threading.Thread(target=self._write_dump, name="metrics-dump", daemon=True)
+            self.dump_thread.start()
+            atexit.register(self.close)
+
+    def span(self, name):
+        """
+        times a block of code, use with a with statement
+        :param name: name of the histogram
+        :return: Span
+        """
+        return Span(self, name)
+
+    def record(self, name, seconds, fields=None):
+        """
+        adds a duration, and the numeric values of the span as histograms named <name>.<key>
+        :param name: name of the histogram
+        :param seconds: duration
+        :param fields: dict of extra values, None for none
+        :return: None
+        """
+        with self.lock:
+            self._add(name + ".ms", seconds * 1000)
+            for key, value in (fields or {}).items():
+                if isinstance(value, (int, float)):
+                    self._add(f"{name}.{key}", value)
+        if self.dump_queue is not None:
+            # serialized on the dump thread
+            self.dump_queue.put((name, time.time(), seconds, fields))
+
+    def _add(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        histogram.add(value)
+
+    def _write_dump(self):
+        while True:
+            span = self.dump_queue.get()
+            if span is None:
+                break
+            name, timestamp, seconds, fields = span
+            self.dump.write(json.dumps(dict(fields or {}, name=name, time=timestamp, ms=seconds * 1000)) + "\n")
+            # written out whenever the queue runs empty
+            if self.dump_queue.empty():
+                self.dump.flush()
+        self.dump.close()
+
+    def close(self):
+        """
+        writes the queued spans and closes the dump file
+        :return: None
+        """
+        if self.dump_thread is not None:
+            self.dump_queue.put(None)
+            self.dump_thread.join()
+            self.dump_thread = None
+
+    def snapshot(self):
+        """
+        :return: dict of histogram name to its summary
+        """
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+
+# metrics of the whole process
+metrics = Metrics(Config.metrics_window, Config.metrics_file)
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+from config import Config
+from ImageProcessing.maze_cache import MazeCache, hamming_distance, perceptual_hash
+from ImageProcessing.preprocess_maze import MazeImage
+
+
+def make_board(shift=(0, 0), seed=0):
+    """
+    camera frame of a board with maze lines on a darker background, moved by shift (rows, cols)
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((1936, 2592), 60, dtype=np.uint8)
+    quad = np.int32([[420, 260], [2250, 300], [2200, 1720], [380, 1680]]) + np.int32([shift[1], shift[0]])
+    cv2.fillPoly(img, [quad], 200)
+    lines = np.random.default_rng(1)
+    for _ in range(40):
+        start = lines.integers([500, 350], [2100, 1600], 2)
+        end = start + lines.integers(-400, 400, 2) * lines.integers(0, 2, 2)
+        cv2.line(img, tuple(int(v) for v in start + shift[::-1]), tuple(int(v) for v in end + shift[::-1]), 30, 14)
+    noise = rng.normal(0, 3, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def is_cache_hit(mi):
+    return "cache_store" not in mi.stage_timings
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "threshold_mode", "full")
+    return MazeCache(str(tmp_path), 1 << 30, Config.maze_cache_max_distance)
+
+
+def test_unchanged_board_hits(cache):
+    MazeImage(Config.aruco_dict, cache=cache).load_initial_image(make_board())
+    mi = MazeImage(Config.aruco_dict, cache=cache)
+    mi.load_initial_image(make_board(seed=1))
+    assert is_cache_hit(mi)
+
+
+def test_shifted_board_misses(cache):
+    board = make_board()
+    shifted = make_board(shift=(20, 40), seed=1)
+    # the hashes alone cannot tell the boards apart
+    assert hamming_distance(perceptual_hash(board), perceptual_hash(shifted)) <= Config.maze_cache_max_distance
+    first = MazeImage(Config.aruco_dict, cache=cache)
+    first.load_initial_image(board)
+    mi = MazeImage(Config.aruco_dict, cache=cache)
+    mi.load_initial_image(shifted)
+    assert not is_cache_hit(mi)
+    assert not np.allclose(mi.warp_matrix, first.warp_matrix)
+    # the moved board is cached on its own
+    again = MazeImage(Config.aruco_dict, cache=cache)
+    again.load_initial_image(make_board(shift=(20, 40), seed=2))
+    assert is_cache_hit(again)
+    assert np.allclose(again.warp_matrix, mi.warp_matrix)
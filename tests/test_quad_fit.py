@@ -0,0 +1,28 @@
+import cv2
+import numpy as np
+import pytest
+
+from ImageProcessing.preprocess_maze import get_best_fit_quad, get_best_fit_quad_brute_force
+
+
+def quad_area(corners):
+    return cv2.contourArea(np.asarray(corners, dtype=np.float32).reshape(-1, 1, 2))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_best_fit_quad_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    points = rng.integers(0, 500, size=(int(rng.integers(4, 40)), 2)).astype(np.int32).reshape(-1, 1, 2)
+    assert quad_area(get_best_fit_quad(points)) == pytest.approx(quad_area(get_best_fit_quad_brute_force(points)))
+
+
+def test_best_fit_quad_of_a_board_contour():
+    mask = np.zeros((400, 600), dtype=np.uint8)
+    board = np.int32([[60, 40], [540, 55], [520, 360], [75, 345]])
+    cv2.fillPoly(mask, [board], 255)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    corners = get_best_fit_quad(contours[0]).reshape(-1, 2)
+    assert quad_area(corners) == pytest.approx(quad_area(get_best_fit_quad_brute_force(contours[0])))
+    # every corner of the board is found
+    distances = np.hypot(*(board[:, None, :] - corners[None, :, :]).transpose(2, 0, 1))
+    assert distances.min(axis=1).max() <= 2
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+import pytest
+
+from config import Config
+from ImageProcessing.preprocess_maze import MazeImage, MAZE_COLOR, fill_aruco, nearest_maze_point_index
+from ImageProcessing.search_env import MazeSearchEnv
+from ImageProcessing.search_agents import create_agent, create_heuristic
+
+START = (20, 20)
+END = (140, 20)
+
+
+class FakeAruco(object):
+    def __init__(self, start, end):
+        corners = [(end[1] - 4, end[0] - 4), (end[1] + 4, end[0] - 4), (end[1] + 4, end[0] + 4), (end[1] - 4, end[0] + 4)]
+        self.aruco_info = {
+            Config.CAR_ID: {"centerY": start[0], "centerX": start[1], "corners": [], "rotation": 0},
+            Config.END_ID: {"centerY": end[0], "centerX": end[1], "corners": corners, "rotation": 0},
+        }
+
+
+def make_skeleton():
+    # a grid of corridors with a wall between the start and the end, the path has to go around it
+    skeleton = np.zeros((160, 240), dtype=np.uint8)
+    for row in (20, 80, 140):
+        cv2.line(skeleton, (20, row), (220, row), MAZE_COLOR, 1)
+    for col in (20, 120, 220):
+        cv2.line(skeleton, (col, 20), (col, 140), MAZE_COLOR, 1)
+    skeleton[30:60, 20] = 0
+    cv2.line(skeleton, (120, 80), (160, 120), MAZE_COLOR, 1)
+    return skeleton
+
+
+@pytest.fixture
+def maze_env():
+    mi = MazeImage(Config.aruco_dict)
+    mi.original_image = make_skeleton()
+    mi.data = np.copy(mi.original_image)
+    mi.nearest_labels, mi.nearest_points = nearest_maze_point_index(mi.original_image)
+    mi.aruco = FakeAruco(START, END)
+    fill_aruco(mi.data, mi.aruco.aruco_info[Config.END_ID]['corners'])
+    return MazeSearchEnv(mi)
+
+
+def path_cost(env, actions):
+    return sum(env.costs[action] for action in actions)
+
+
+
+def weighted_cost(env):
+    return create_agent("weighted", env, 0.5, create_heuristic("manhattan")).run_search()[1]
+
+
+def check_agent_cost(env, name):
+    expected = weighted_cost(env)
+    # longer than the way through the wall
+    assert expected > abs(END[0] - START[0]) + abs(END[1] - START[1])
+    actions, cost, _ = create_agent(name, env, 0.5, create_heuristic("manhattan")).run_search()
+    assert cost == expected
+    assert path_cost(env, actions) == expected
+
+
+def test_array_agent_matches_weighted(maze_env):
+    check_agent_cost(maze_env, "array")
+
+
+def test_graph_agent_matches_weighted(maze_env):
+    check_agent_cost(maze_env, "graph")
+
+
+def test_incremental_agent_matches_weighted(maze_env):
+    check_agent_cost(maze_env, "incremental")
+
+
+def test_distance_field_agent_matches_weighted(maze_env):
+    check_agent_cost(maze_env, "distance_field")
+
+
+@pytest.mark.parametrize("name", ["weighted", "array"])
+def test_distance_field_heuristic_keeps_the_cost(maze_env, name):
+    expected = create_agent(name, maze_env, 0.5, create_heuristic("manhattan")).run_search()[1]
+    actions, cost, _ = create_agent(name, maze_env, 0.5, create_heuristic("distance_field")).run_search()
+    assert cost == expected
+    cords = maze_env.actions_to_cords(actions)
+    assert cords[0] == maze_env.get_initial_state().get_value()
+
+
+def test_theta_agent_plans_segments_inside_the_maze(maze_env):
+    agent = create_agent("theta", maze_env, 0.5, create_heuristic("manhattan"))
+    actions, cost, _ = agent.run_search()
+    assert cost != -1
+    assert agent.waypoints[0] == maze_env.get_initial_state().get_value()
+    # the straight line is never longer than the shortest path on the skeleton
+    assert cost <= weighted_cost(maze_env)